@@ -1,88 +1,91 @@
 import numpy as np
 import openpyxl as px
 import matplotlib.pyplot as plt
-import os 
+from matplotlib.figure import Figure
+import os
 import csv
+import glob
+import argparse
+import warnings
+import multiprocessing
 
 '''Instructions:
 1) Export OpenRocket simulation data to '.csv' format. (See example: 'SSI-IREC-2017_OpenRocket.csv') Be sure to use in, lb, s
-2) Create the aerodynamic data file. (See example: SSI-IREC-2017_AeroData.xlsx) a. Over a range of Mach numbers, copy the aerodynamic data using the 'Component Analysis' feature of OpenRocket. Follow the exact column format of the example file. Be sure to follow the specified units. Do not change the sheet name from 'Sheet1'.
+2) Create the aerodynamic data file. (See example: SSI-IREC-2017_AeroData.xlsx) a. Over a range of Mach numbers, copy the aerodynamic data using the 'Component Analysis' feature of OpenRocket. Follow the column format of the example file: Mach, CN_alpha and CP, then the CN_alpha of each component, then the CP of each component, for any number of components. Be sure to follow the specified units. Do not change the sheet name from 'Sheet1'.
 3) Update the nozzle exit plane location value (see 'OpenRocket Inputs') in the 'DampingCalcs.m' file. Be sure to follow the specified units.
 4) Run 'DampingCalcs.m' and follow the prompts to select the two required files from steps 1-2.'''
 
+'''Columns used from the OpenRocket CSV export: the field name in the export's field descriptions (the commented header line),
+and the column index in OpenRocket's default export, used if the export was saved without field descriptions.'''
+CSV_COLUMNS = {
+    'time': ('Time', 0),
+    'vert_velocity': ('Vertical velocity', 2),
+    'velocity': ('Total velocity', 4),
+    'prop_mass': ('Propellant mass', 20),
+    'I_long': ('Longitudinal moment of inertia', 21),
+    'cg': ('CG location', 24),
+    'area_ref': ('Reference area', 45),
+    'air_temp': ('Air temperature', 49),
+    'air_pressure': ('Air pressure', 50),
+}
+
 def run_sim(csv_file_name,xlsx_file_name, X_ne, min_DR=0.05, max_DR=0.3, file_path='-'):
     '''Using OpenRocket simulation data exported as a CSV and an Aero file as a XSLX, runs dynamic stability calculation and outputs graphs to demonstrate stability coefficients as a function of time. X_ne is distance from tip of nosecone to nozzle exit in inches; min/max_DR are limits on dynamic stability ratio acceptable range; file_path is the directory location of the file, not including the file name.'''
-    
+
     #load current file path if not provided
     if file_path=='-':
         file_path = ask_file()
 
-    
+    results = analyze(os.path.join(file_path,csv_file_name), os.path.join(file_path,xlsx_file_name), X_ne)
+    print("Burnout Time: ", results['burnout_time'])
+    print("Apogee Time: ", results['apogee_time'])
+    plot_results(results, min_DR, max_DR)
+    return results
+
+def analyze(csv_path, xlsx_path, X_ne):
+    '''Run the dynamic stability calculation on an OpenRocket CSV export and its aero XLSX, returning a dict of the results: the time series time, DR, SM, NF, q, C1, C2, C2R and C2A, the burnout_time and apogee_time, and DR_valid_ind, the index of the last valid damping ratio. X_ne is distance from tip of nosecone to nozzle exit in inches.'''
+
     #Load files
-    data = load_csvfile(file_path, csv_file_name)
-    data = np.asarray(data)
-    aero_data = load_xlsfile(file_path,xlsx_file_name)
-    aero_data = np.asarray(aero_data)
-                            
+    data, columns = load_csvfile(*os.path.split(csv_path))
+    aero_data = load_xlsfile(*os.path.split(xlsx_path))
+
     #Constants
-    rowoffset = 9
-    coloffset = 0
     R_air = 287.1 #J/(kg*K)
-    gamma = 1.4                       
-    time_ind = 0
-    cg_ind = 24
-    air_temp_ind = 49
-    air_pressure_ind = 50
-    vert_velocity_ind = 2
-    velocity_ind = 4
-    area_ref_ind = 45
-    prop_mass_ind = 20
-    I_long_ind = 21  
-                            
-    #Aero data extraction                        
+    gamma = 1.4
+
+    #Aero data extraction: columns are Mach, the rocket's CN_alpha and CP, then each component's CN_alpha, then each component's CP
     Mach_ind = aero_data[:,0] #Range of Mach numbers over which aerodynamics are characterized
-    CN_alpha_ind = aero_data[:,1] 
-    CP_ind = aero_data[:,2]
-    CN_alpha_nc_ind = aero_data[:,3]
-    CN_alpha_cans_ind = aero_data[:,4] 
-    CN_alpha_fins_ind = aero_data[:,5]
-    CN_alpha_tc_ind = aero_data[:,6]
-    CP_nc_ind = aero_data[:,7] # in
-    CP_cans_ind = aero_data[:,8] # in
-    CP_fins_ind = aero_data[:,9] # in
-    CP_tc_ind = aero_data[:,10] #in   
-                            
+    num_components = (aero_data.shape[1]-3)//2
+    if num_components < 1 or aero_data.shape[1] != 3 + 2*num_components:
+        raise ValueError(os.path.basename(xlsx_path) + ' should have Mach, CN_alpha and CP columns, then a CN_alpha and a CP column for each component')
+    aero_table = aero_data[:,1:].T.copy() # (2 + 2*num_components) x Mach: CN_alpha, CP, component CN_alphas, component CPs (in)
+
     #Sim data Extraction
-    time = data[:,time_ind]
-    CG = data[:,cg_ind]
-    air_temp = data[:,air_temp_ind]
-    air_pressure = data[:,air_pressure_ind]
-    vert_velocity = data[:,vert_velocity_ind]
-    velocity = data[:,velocity_ind]
-    area_ref = data[:,area_ref_ind]
-    prop_mass = data[:,prop_mass_ind]
-    I_long = data[:,I_long_ind]  
-    burnout_time=time[[i for i,x in enumerate(prop_mass) if x==0][0]]
-    apogee_time=time[[i for i,x in enumerate(vert_velocity) if x<=0][1]]
-    print "Burnout Time: ", burnout_time
-    print "Apogee Time: ", apogee_time
-    
+    time = get_column(data, columns, 'time')
+    CG = get_column(data, columns, 'cg')
+    air_temp = get_column(data, columns, 'air_temp')
+    air_pressure = get_column(data, columns, 'air_pressure')
+    vert_velocity = get_column(data, columns, 'vert_velocity')
+    velocity = get_column(data, columns, 'velocity')
+    area_ref = get_column(data, columns, 'area_ref')
+    prop_mass = get_column(data, columns, 'prop_mass')
+    I_long = get_column(data, columns, 'I_long')
+    burnout_time=time[np.flatnonzero(prop_mass==0)[0]]
+    apogee_time=time[np.flatnonzero(vert_velocity<=0)[1]]
+
     #Conversion
     X_ne = 0.0254*X_ne
-    CP_ind = np.multiply(0.0254,CP_ind)
-    CP_nc_ind = np.multiply(0.0254,CP_nc_ind)
-    CP_cans_ind = np.multiply(0.0254,CP_cans_ind)
-    CP_fins_ind = np.multiply(0.0254,CP_fins_ind)
-    CP_tc_ind = np.multiply(0.0254,CP_tc_ind)
+    aero_table[1] *= 0.0254 # CP from in to m
+    aero_table[2+num_components:] *= 0.0254 # component CPs from in to m
     CG = np.multiply(0.0254,CG) # convert from in to m
-                            
+
     air_temp = np.divide(np.add(air_temp, 459.7),1.8) # convert from F to K
     air_pressure = np.multiply(1e2,air_pressure) # convert from mbar to Pa
     velocity = np.multiply(0.3048,velocity) # ft/s to m/s
     area_ref = np.multiply(6.452e-4,area_ref) # in^2 to m^2
     prop_mass = np.multiply(0.4536,prop_mass) # lb to kg
     I_long = np.multiply(0.04214,I_long) # lb*ft^2 to kg*m^2
-    
+
     #Calculations
     rho_air = np.divide(air_pressure,(R_air*air_temp))
     prop_m_dot = np.multiply(-1,np.divide(np.diff(prop_mass),np.diff(time)))
@@ -91,88 +94,105 @@ def run_sim(csv_file_name,xlsx_file_name, X_ne, min_DR=0.05, max_DR=0.3, file_pa
     mach = np.divide(velocity,sound_speed)
     L_ref = np.sqrt(np.multiply((4/np.pi),area_ref))
     q = np.multiply(0.5,np.multiply(rho_air,np.power(velocity,2)))
-                                            
-                                                        
-    #Interpolation of Aero file
-    CN_alpha = np.interp(mach, Mach_ind, CN_alpha_ind)
-    CP = np.interp(mach, Mach_ind, CP_ind)
-    CN_alpha_nc = np.interp(mach, Mach_ind, CN_alpha_nc_ind)
-    CN_alpha_cans = np.interp(mach, Mach_ind, CN_alpha_cans_ind)
-    CN_alpha_fins = np.interp(mach, Mach_ind, CN_alpha_fins_ind)
-    CN_alpha_tc = np.interp(mach, Mach_ind, CN_alpha_tc_ind)
-    CP_nc = np.interp(mach, Mach_ind, CP_nc_ind)
-    CP_cans = np.interp(mach, Mach_ind, CP_cans_ind)
-    CP_fins = np.interp(mach, Mach_ind, CP_fins_ind)
-    CP_tc = np.interp(mach, Mach_ind, CP_tc_ind)
-    
+
+
+    #Interpolation of Aero file, every column at once
+    aero = interp_rows(mach, Mach_ind, aero_table)
+    CN_alpha = aero[0]
+    CP = aero[1]
+    CN_alpha_comp = aero[2:2+num_components] # components x time
+    CP_comp = aero[2+num_components:] # components x time
+
     #Calculations
-                            
+
     C1 = 0.5*np.multiply(rho_air,np.multiply(np.power(velocity,2),np.multiply(area_ref,np.multiply(CN_alpha,np.subtract(CP,CG))))) # Corrective moment coefficient
     C2R = np.multiply(prop_m_dot,np.power((np.subtract(X_ne,CG)),2)) # Propulsive damping coefficient
-    C2A = 0.5*np.multiply(rho_air,np.multiply(velocity,np.multiply(area_ref,(np.add(np.multiply(CN_alpha_nc,np.power(np.subtract(CP_nc,CG),2)),np.add(np.multiply(CN_alpha_cans,np.power(np.subtract(CP_cans,CG),2)),np.add(np.multiply(CN_alpha_fins,np.power(np.subtract(CP_fins,CG),2)),np.multiply(CN_alpha_tc,np.power(np.subtract(CP_tc,CG),2))))))))) # Aerodynamic damping coefficient
+    C2A = 0.5*rho_air*velocity*area_ref*np.sum(CN_alpha_comp*(CP_comp-CG)**2, axis=0) # Aerodynamic damping coefficient, summed over the components
     C2 = np.add(C2R,C2A) # Damping coefficient
     DR = np.divide(C2,np.multiply(2,np.sqrt(np.multiply(C1,I_long)))) # Damping Ratio
-    SM = np.divide(np.subtract(CP,CG),L_ref)    
-    NF = np.divide(np.sqrt(np.divide(C1,I_long)),2*np.pi) #Natural frequency 
-                            
-    DR_valid_ind = [i for i,x in enumerate(DR) if ~np.isnan(x)][-1]
-    
-    
-    #Plotting
-    plt.figure(1)
-    plt.xlabel('Time (s)')
-    plt.ylabel('Damping Ratio $\zeta$')
-    plt.axis((0,time[len(time)/2],0,0.5))
-    plt.plot(time,DR)
-    plt.plot(time[:DR_valid_ind],min_DR*np.ones(DR_valid_ind),'--',label='Min')
-    plt.plot(time[:DR_valid_ind],max_DR*np.ones(DR_valid_ind),'--',label='Max')
-    plt.plot(np.dot(burnout_time,np.ones(2)),[0,1],'r-.',label='Burnout',linewidth=0.4)
-    plt.plot(apogee_time*np.ones(2),[0,1],'k-.',label='Apogee',linewidth=0.4)
-    plt.legend()
-    
-    plt.figure(2)
-    plt.xlabel('Time (s)')
-    plt.ylabel('Stability Margin (cal)')
-    plt.plot(burnout_time*np.ones(2),[0,12],'r-.',label='Burnout',linewidth=0.4)
-    plt.plot(apogee_time*np.ones(2),[0,12],'k-.',label='Apogee',linewidth=0.4)
-    plt.axis((0,time[len(time)/2],0,12))
-    plt.plot(time[:DR_valid_ind],SM[:DR_valid_ind])
-    plt.legend()
-    
-    plt.figure(3)
-    plt.xlabel('Time (s)')
-    plt.ylabel('Dynamic Pressure (kPa)')
-    plt.plot(burnout_time*np.ones(2),[0,100],'r-.',label='Burnout',linewidth=0.4)
-    plt.plot(apogee_time*np.ones(2),[0,100],'k-.',label='Apogee',linewidth=0.4)
-    plt.plot(time[:DR_valid_ind],np.divide(q[:DR_valid_ind],1e3))
-    plt.legend()
-    
-    plt.figure(4)
-    plt.xlabel('Time (s)')
-    plt.ylabel('Corrective Moment Coefficient (Nm)')
-    plt.plot(time[:DR_valid_ind],C1[:DR_valid_ind])
-    plt.plot(burnout_time*np.ones(2),[0,10000],'r-.',label='Burnout',linewidth=0.4)
-    plt.plot(apogee_time*np.ones(2),[0,10000],'k-.',label='Apogee',linewidth=0.4)
-    plt.legend()
-    
-    plt.figure(5)
-    plt.xlabel('Time (s)')
-    plt.ylabel('Damping Moment Coefficient')
-    plt.plot(time[:DR_valid_ind],C2R[:DR_valid_ind],label='Propulsive')
-    plt.plot(time[:DR_valid_ind],C2A[:DR_valid_ind],label='Aerodynamic')                    
-    plt.plot(time[:DR_valid_ind],C2[:DR_valid_ind],label='Total') 
-    plt.plot(burnout_time*np.ones(2),[0,60],'r-.',label='Burnout',linewidth=0.4)
-    plt.plot(apogee_time*np.ones(2),[0,60],'k-.',label='Apogee',linewidth=0.4)
-    plt.legend()
-    
-    plt.figure(6)
-    plt.xlabel('Time (s)')
-    plt.ylabel('Natural Frequency (Hz)')
-    plt.plot(time[:DR_valid_ind],NF[:DR_valid_ind])
-    plt.plot(burnout_time*np.ones(2),[0,7],'r-.',label='Burnout',linewidth=0.4)
-    plt.plot(apogee_time*np.ones(2),[0,7],'k-.',label='Apogee',linewidth=0.4)
-    plt.legend()
-    
+    SM = np.divide(np.subtract(CP,CG),L_ref)
+    NF = np.divide(np.sqrt(np.divide(C1,I_long)),2*np.pi) #Natural frequency
+
+    DR_valid_ind = np.flatnonzero(~np.isnan(DR))[-1]
+
+    return {'time':time, 'DR':DR, 'SM':SM, 'NF':NF, 'q':q, 'C1':C1, 'C2':C2, 'C2R':C2R, 'C2A':C2A,
+            'burnout_time':burnout_time, 'apogee_time':apogee_time, 'DR_valid_ind':DR_valid_ind}
+
+def plot_results(results, min_DR=0.05, max_DR=0.3, new_figure=plt.figure):
+    '''Plot the results of analyze, returning a dict of the figures by the quantity they show: DR, SM, q, C1, C2 and NF. new_figure(num) makes each figure, pyplot's by default; pass e.g. lambda num: Figure() to draw off screen.'''
+    time, DR, SM, NF, q, C1, C2, C2R, C2A = [results[x] for x in ['time', 'DR', 'SM', 'NF', 'q', 'C1', 'C2', 'C2R', 'C2A']]
+    burnout_time, apogee_time, DR_valid_ind = results['burnout_time'], results['apogee_time'], results['DR_valid_ind']
+
+    figures = {}
+    figures['DR'] = new_figure(1)
+    ax = figures['DR'].gca()
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel(r'Damping Ratio $\zeta$')
+    ax.axis((0,time[len(time)//2],0,0.5))
+    ax.plot(time,DR)
+    ax.plot(time[:DR_valid_ind],min_DR*np.ones(DR_valid_ind),'--',label='Min')
+    ax.plot(time[:DR_valid_ind],max_DR*np.ones(DR_valid_ind),'--',label='Max')
+    ax.plot(np.dot(burnout_time,np.ones(2)),[0,1],'r-.',label='Burnout',linewidth=0.4)
+    ax.plot(apogee_time*np.ones(2),[0,1],'k-.',label='Apogee',linewidth=0.4)
+    ax.legend()
+
+    figures['SM'] = new_figure(2)
+    ax = figures['SM'].gca()
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Stability Margin (cal)')
+    ax.plot(burnout_time*np.ones(2),[0,12],'r-.',label='Burnout',linewidth=0.4)
+    ax.plot(apogee_time*np.ones(2),[0,12],'k-.',label='Apogee',linewidth=0.4)
+    ax.axis((0,time[len(time)//2],0,12))
+    ax.plot(time[:DR_valid_ind],SM[:DR_valid_ind])
+    ax.legend()
+
+    figures['q'] = new_figure(3)
+    ax = figures['q'].gca()
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Dynamic Pressure (kPa)')
+    ax.plot(burnout_time*np.ones(2),[0,100],'r-.',label='Burnout',linewidth=0.4)
+    ax.plot(apogee_time*np.ones(2),[0,100],'k-.',label='Apogee',linewidth=0.4)
+    ax.plot(time[:DR_valid_ind],np.divide(q[:DR_valid_ind],1e3))
+    ax.legend()
+
+    figures['C1'] = new_figure(4)
+    ax = figures['C1'].gca()
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Corrective Moment Coefficient (Nm)')
+    ax.plot(time[:DR_valid_ind],C1[:DR_valid_ind])
+    ax.plot(burnout_time*np.ones(2),[0,10000],'r-.',label='Burnout',linewidth=0.4)
+    ax.plot(apogee_time*np.ones(2),[0,10000],'k-.',label='Apogee',linewidth=0.4)
+    ax.legend()
+
+    figures['C2'] = new_figure(5)
+    ax = figures['C2'].gca()
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Damping Moment Coefficient')
+    ax.plot(time[:DR_valid_ind],C2R[:DR_valid_ind],label='Propulsive')
+    ax.plot(time[:DR_valid_ind],C2A[:DR_valid_ind],label='Aerodynamic')
+    ax.plot(time[:DR_valid_ind],C2[:DR_valid_ind],label='Total')
+    ax.plot(burnout_time*np.ones(2),[0,60],'r-.',label='Burnout',linewidth=0.4)
+    ax.plot(apogee_time*np.ones(2),[0,60],'k-.',label='Apogee',linewidth=0.4)
+    ax.legend()
+
+    figures['NF'] = new_figure(6)
+    ax = figures['NF'].gca()
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Natural Frequency (Hz)')
+    ax.plot(time[:DR_valid_ind],NF[:DR_valid_ind])
+    ax.plot(burnout_time*np.ones(2),[0,7],'r-.',label='Burnout',linewidth=0.4)
+    ax.plot(apogee_time*np.ones(2),[0,7],'k-.',label='Apogee',linewidth=0.4)
+    ax.legend()
+    return figures
+
+def interp_rows(x, xp, fp):
+    '''Linearly interpolate every row of fp (rows x len(xp)) at the points x, as np.interp does for one row, returning a (rows x len(x)) matrix. The interval of each point is searched for once for all rows.'''
+    if len(xp) < 2:
+        return np.repeat(fp[:, :1], len(x), axis=1)
+    i = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    with np.errstate(invalid='ignore'):
+        w = np.clip((x - xp[i])/(xp[i+1] - xp[i]), 0, 1) # outside xp, hold the end values like np.interp
+    return fp[:, i] + (fp[:, i+1] - fp[:, i])*w
 
 def ask_file():
     '''Load current file location'''
@@ -180,38 +200,185 @@ def ask_file():
     return dir_path
 
 def load_csvfile(file_path,file_name):
-    '''Load a CSV at file_path/file_name, collecting and returning the information in a matrix'''
-    data = []
-    try:
-        with open(file_path+"\\"+file_name, 'r') as f:
-            for line in f:
-                data_line = line.split(",")
-                if len(data_line)>1 and line[0]!='#':
-                    data.append([float(i) for i in data_line])
-        return data
-    except:
-        print(file_path+"\\"+file_name)
-        print 'CSV file doesn\'t exist'
-        return -1
+    '''Load an OpenRocket CSV export at file_path/file_name, returning (data, columns): a matrix with a row per time step, and a dict of the export's field names (lower case, without units) to column indices, empty if the export has no field descriptions.'''
+    parsed = load_cached(os.path.join(file_path,file_name), parse_csvfile)
+    columns = {}
+    for i, field in enumerate(parsed['fields']):
+        columns.setdefault(str(field), i)
+    return parsed['data'], columns
+
+def parse_csvfile(csv_path):
+    '''Parse an OpenRocket CSV export into its data matrix and field names, see load_csvfile.'''
+    with open(csv_path, 'r') as f:
+        lines = f.read().splitlines()
+
+    # The field descriptions are the first comment line listing several fields, e.g. '# Time (s),Altitude (ft),...'
+    fields = []
+    for line in lines:
+        if line.startswith('#') and ',' in line:
+            fields = [field.split('(')[0].strip().casefold() for field in line.lstrip('#').split(',')]
+            break
+
+    # Parse every data line in one pass, skipping comments (field descriptions, events) and blank lines
+    rows = [line for line in lines if ',' in line and not line.startswith('#')]
+    if not rows:
+        raise ValueError(csv_path + ' has no data')
+    num_cols = rows[0].count(',') + 1
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning) # older numpy warns rather than raising on unparseable text, caught below
+        data = np.fromstring(','.join(rows), dtype=np.float64, sep=',')
+    if data.size != len(rows)*num_cols:
+        raise ValueError(csv_path + ' has rows that aren\'t ' + str(num_cols) + ' numbers')
+    return {'data': data.reshape(len(rows), num_cols), 'fields': np.array(fields, dtype=str)}
+
+def get_column(data, columns, key):
+    '''Return the column of CSV data for key in CSV_COLUMNS, by its field name if the export has field descriptions, otherwise by its default index.'''
+    name, index = CSV_COLUMNS[key]
+    return data[:, columns.get(name.casefold(), index)]
 
 def load_xlsfile(file_path,file_name):
-    '''Load a XLSX file , collecting and returning the information in a matrix'''
-    W = px.load_workbook(file_path+'\\'+file_name)
-    sheet_names = W.sheetnames
-    p = W[sheet_names[0]]
-
-    a=[]
-    i = 0
-    j = 0
-    rows = 0
-    for row in p.iter_rows():
-        if i!= 0:
-            for k in row:
-                j+=1
-                a.append(float(k.internal_value))
-        i+=1
-        if rows == 0:
-            rows = j
-    a=[a]
-    aa= np.resize(a, (rows, i))
-    return aa
\ No newline at end of file
+    '''Load a XLSX file, returning its first sheet below the header row as a matrix with a row per Mach number.'''
+    return load_cached(os.path.join(file_path,file_name), parse_xlsfile)['aero_data']
+
+def parse_xlsfile(xlsx_path):
+    '''Read the aero table from a XLSX file, see load_xlsfile.'''
+    W = px.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        p = W[W.sheetnames[0]]
+        rows = [row for row in p.iter_rows(min_row=2, values_only=True) if any(x is not None for x in row)]
+    finally:
+        W.close()
+    num_cols = max((len(row) for row in rows), default=0)
+    return {'aero_data': np.array([row + (None,)*(num_cols-len(row)) for row in rows], dtype=np.float64)} # empty cells (None) become NaN
+
+def load_cached(path, parse):
+    '''Return parse(path), a dict of arrays, caching it as a .npz next to the file. While the file is unchanged (same modification time and size), later loads read the .npz instead of parsing the file again.'''
+    cache_path = path + '.npz'
+    stat = os.stat(path)
+    source = np.array([stat.st_mtime, stat.st_size])
+    try:
+        with np.load(cache_path) as cached:
+            if np.array_equal(cached['source'], source):
+                return {key: cached[key] for key in cached.files if key != 'source'}
+    except (OSError, KeyError, ValueError): # no cache yet, or an unreadable one
+        pass
+
+    parsed = parse(path)
+    temp_path = cache_path + '.' + str(os.getpid()) + '.tmp' # write then rename, so other processes never read half a cache
+    try:
+        with open(temp_path, 'wb') as f:
+            np.savez(f, source=source, **parsed)
+        os.replace(temp_path, cache_path)
+    except OSError: # e.g. a read-only directory, just don't cache
+        pass
+    return parsed
+
+'''Batch mode: analyze many exports at once, spread over a process pool, and summarize each in a table.'''
+SUMMARY_FIELDS = ['file', 'burnout (s)', 'apogee (s)', 'DR min', 'DR max', 'SM min (cal)', 'SM max (cal)', 'NF max (Hz)',
+                  'below min DR (s)', 'above max DR (s)']
+
+def find_exports(patterns):
+    '''Return the CSV exports named by patterns, each a file, a directory (all the .csv files in it) or a glob pattern.'''
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.csv')
+        paths += sorted(glob.glob(pattern))
+    return list(dict.fromkeys(paths)) # without duplicates, in order
+
+def find_aero_file(csv_path):
+    '''Return the aero XLSX for an export: the .xlsx with the same name next to it.'''
+    return os.path.splitext(csv_path)[0] + '.xlsx'
+
+def summarize(results, min_DR=0.05, max_DR=0.3):
+    '''Return a summary of the results of analyze over the plotted window (up to the last valid damping ratio): the burnout and apogee times, the extremes of DR, SM and NF, and how long DR spends outside of [min_DR, max_DR].'''
+    time, DR, SM, NF = results['time'], results['DR'], results['SM'], results['NF']
+    window = np.zeros(len(time), dtype=bool)
+    window[:results['DR_valid_ind']] = True
+    window &= np.isfinite(DR)
+    dt = np.diff(time, append=time[-1])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # all-NaN windows give NaN
+        return {'burnout (s)': results['burnout_time'], 'apogee (s)': results['apogee_time'],
+                'DR min': np.nanmin(np.where(window, DR, np.nan)), 'DR max': np.nanmax(np.where(window, DR, np.nan)),
+                'SM min (cal)': np.nanmin(np.where(window, SM, np.nan)), 'SM max (cal)': np.nanmax(np.where(window, SM, np.nan)),
+                'NF max (Hz)': np.nanmax(np.where(window, NF, np.nan)),
+                'below min DR (s)': np.sum(dt[window & (DR < min_DR)]), 'above max DR (s)': np.sum(dt[window & (DR > max_DR)])}
+
+def analyze_export(job):
+    '''Analyze one export of a batch, returning its summary row, or a row with an 'error' if the analysis failed. Plots are saved as PNGs in job['plot_dir'] if it is set.'''
+    row = {'file': job['csv_path']}
+    try:
+        results = analyze(job['csv_path'], job['xlsx_path'], job['X_ne'])
+        row.update(summarize(results, job['min_DR'], job['max_DR']))
+        if job['plot_dir'] is not None:
+            name = os.path.splitext(os.path.basename(job['csv_path']))[0]
+            figures = plot_results(results, job['min_DR'], job['max_DR'], new_figure=lambda num: Figure()) # drawn with Agg, off screen
+            for quantity, figure in figures.items():
+                figure.savefig(os.path.join(job['plot_dir'], name + '_' + quantity + '.png'))
+    except Exception as e:
+        row['error'] = type(e).__name__ + ': ' + str(e)
+    return row
+
+def run_batch(csv_paths, X_ne, aero_file=None, min_DR=0.05, max_DR=0.3, workers=None, plot_dir=None):
+    '''Analyze many exports in parallel, returning a summary row (see summarize) for each, in order.
+       aero_file: the aero XLSX shared by every export, or None to use each export's own, see find_aero_file
+       workers: number of worker processes, defaults to the number of CPUs
+       plot_dir: directory to save each export's plots in, or None to skip plotting'''
+    jobs = [{'csv_path': csv_path, 'xlsx_path': aero_file if aero_file is not None else find_aero_file(csv_path), 'X_ne': X_ne,
+             'min_DR': min_DR, 'max_DR': max_DR, 'plot_dir': plot_dir} for csv_path in csv_paths]
+    if plot_dir is not None:
+        os.makedirs(plot_dir, exist_ok=True)
+    for xlsx_path in set(job['xlsx_path'] for job in jobs): # parse each aero table once here, workers load the cached .npz
+        try:
+            load_xlsfile(*os.path.split(xlsx_path))
+        except Exception:
+            pass # reported per export by the workers
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if workers <= 1:
+        return [analyze_export(job) for job in jobs]
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        return list(pool.imap(analyze_export, jobs))
+
+def format_summary(rows):
+    '''Return summary rows as a table for the console, errors listed below it.'''
+    widths = [32] + [max(12, len(field)) for field in SUMMARY_FIELDS[1:]]
+    lines = ['  '.join('{:>{}}'.format(field, width) if i else '{:<{}}'.format(field, width) for i, (field, width) in enumerate(zip(SUMMARY_FIELDS, widths)))]
+    errors = []
+    for row in rows:
+        name = os.path.basename(row['file'])
+        if 'error' in row:
+            errors.append(name + ': ' + row['error'])
+            continue
+        lines.append('  '.join(['{:<32}'.format(name)] + ['{:>{}.3f}'.format(row[field], width) for field, width in zip(SUMMARY_FIELDS[1:], widths[1:])]))
+    return '\n'.join(lines + errors)
+
+def write_summary(rows, path):
+    '''Write summary rows to a CSV file, with an error column for exports that failed.'''
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS + ['error'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Dynamic stability analysis of OpenRocket CSV exports (in, lb, s), see the instructions above.')
+    parser.add_argument('exports', nargs='+', help='CSV exports: files, directories or glob patterns')
+    parser.add_argument('--x-ne', type=float, required=True, help='distance from tip of nosecone to nozzle exit, in')
+    parser.add_argument('--aero', help='aero XLSX used for every export (default: the .xlsx with the same name as each export)')
+    parser.add_argument('--min-dr', type=float, default=0.05, help='minimum acceptable damping ratio (default: %(default)s)')
+    parser.add_argument('--max-dr', type=float, default=0.3, help='maximum acceptable damping ratio (default: %(default)s)')
+    parser.add_argument('--workers', type=int, help='worker processes (default: number of CPUs)')
+    parser.add_argument('--plots', metavar='DIR', help='save each export\'s plots as PNGs in DIR')
+    parser.add_argument('--summary', metavar='FILE', help='also write the summary table to FILE as CSV')
+    args = parser.parse_args(argv)
+
+    csv_paths = find_exports(args.exports)
+    if not csv_paths:
+        parser.error('no exports found')
+    rows = run_batch(csv_paths, args.x_ne, args.aero, args.min_dr, args.max_dr, args.workers, args.plots)
+    print(format_summary(rows))
+    if args.summary is not None:
+        write_summary(rows, args.summary)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
+import multiprocessing
 from lib.ORKPlusApp import ORKPlusApp
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support() # lets simulation worker processes start from a frozen executable
     app = ORKPlusApp()
     app.run()
\ No newline at end of file
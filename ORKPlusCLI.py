@@ -0,0 +1,6 @@
+import multiprocessing
+from lib.ORKPlusCLI import main
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support() # lets simulation worker processes start from a frozen executable
+    main()
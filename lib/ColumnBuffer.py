@@ -0,0 +1,66 @@
+'''
+ColumnBuffer:
+
+A growable numpy buffer for recording a fixed set of columns one row (time step) at a time, without knowing the
+number of steps in advance. Each column is stored contiguously in a (columns x capacity) array, the capacity doubling
+whenever it fills up, so appending is amortized O(1) and reading a column back is a zero-copy view.
+'''
+
+import numpy as np
+
+class ColumnBuffer:
+    def __init__(self, keys, capacity=1024, dtype=np.float64, fill=np.nan):
+        ''' keys: the columns, in order. Columns can be looked up by key or by index, and more added with add_column.
+            capacity: initial number of rows
+            dtype: numpy dtype of the values, e.g. np.float32 to halve the memory used
+            fill: value of entries that haven't been written to
+        '''
+        self.keys = list(keys)
+        self.index = {key:i for i, key in enumerate(self.keys)}
+        self.dtype = np.dtype(dtype)
+        self.fill = fill
+        self.buffer = np.full((len(self.keys), max(1, capacity)), fill, dtype=self.dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, capacity):
+        ''' Grow the buffer to hold at least capacity rows. '''
+        if capacity > self.buffer.shape[1]:
+            grown = np.full((len(self.keys), max(capacity, 2*self.buffer.shape[1])), self.fill, dtype=self.dtype)
+            grown[:,:self.size] = self.buffer[:,:self.size]
+            self.buffer = grown
+
+    def append_row(self):
+        ''' Add a row of fill values, returning it as a writable view indexed by column number. '''
+        self.reserve(self.size + 1)
+        row = self.buffer[:,self.size]
+        self.size += 1
+        return row
+
+    def append_rows(self, num_rows):
+        ''' Add num_rows rows of fill values, returning them as a writable (columns x num_rows) view. '''
+        self.reserve(self.size + num_rows)
+        rows = self.buffer[:,self.size:self.size+num_rows]
+        self.size += num_rows
+        return rows
+
+    def add_column(self, key):
+        ''' Add a column, filled with fill values for the rows already written. Returns its index. '''
+        self.index[key] = len(self.keys)
+        self.keys.append(key)
+        self.buffer = np.concatenate((self.buffer, np.full((1, self.buffer.shape[1]), self.fill, dtype=self.dtype)))
+        return self.index[key]
+
+    def column(self, key):
+        ''' Returns a view of the rows written so far of a column, looked up by key or index. '''
+        return self.buffer[self.index[key] if key in self.index else key,:self.size]
+
+    def columns(self):
+        ''' Returns a view of every column's rows written so far, as a (columns x rows) array. '''
+        return self.buffer[:,:self.size]
+
+    def views(self):
+        ''' Returns a dict of each key to a view of its column. '''
+        return {key:self.buffer[i,:self.size] for i, key in enumerate(self.keys)}
@@ -21,6 +21,7 @@ import mplcursors
 from .units import units
 from orhelper import FlightDataType
 from .orhelperhelper import DataTypeMap, EventTypeMap
+from . import metrics # registers the derived metrics' data types, before DataSelector lists them
 import matplotlib.transforms as transforms
 
 linestyle_tuple = [
@@ -67,6 +68,14 @@ class FreePlotPane(ttk.Notebook):
     def update_sim(self,newsim):
         self.sim = newsim
 
+    def get_datatypes(self):
+        ''' Returns every data type selected for plotting on any page. '''
+        datatypes = []
+        for selectors in self.selectors:
+            for selector in selectors[:2]:
+                datatypes += selector.get_datatypes()[0]
+        return datatypes
+
     def update(self,index = None,keep_lims=False,iter_change=False):
         def plot_events(ax):
             events = self.sim.events[int(self.iteratorsels[index].get())-1]
@@ -116,12 +125,16 @@ class FreePlotPane(ttk.Notebook):
         plot_events(ax[0])
         for i in range(len(leftseltypes)):
             datatype = leftseltypes[i]
-            plotdata = units.convert(data[datatype],DataTypeMap[datatype].unit,self.selectors[index][0].get_unit())
+            if not has_datatype(data,datatype):
+                continue
+            plotdata = data.in_unit(datatype,self.selectors[index][0].get_unit())
             ax[0].plot(data[FlightDataType.TYPE_TIME],plotdata,color=ax1_color,linestyle=linestyle_tuple[i],label=DataTypeMap[datatype].name)
         
         for i in range(len(rightseltypes)):
             datatype = rightseltypes[i]
-            plotdata = units.convert(data[datatype],DataTypeMap[datatype].unit,self.selectors[index][1].get_unit())
+            if not has_datatype(data,datatype):
+                continue
+            plotdata = data.in_unit(datatype,self.selectors[index][1].get_unit())
             ax[1].plot(data[FlightDataType.TYPE_TIME],plotdata,color=ax2_color,linestyle=linestyle_tuple[i],label=DataTypeMap[datatype].name)
         
         handles, labels = [(a + b) for a, b in zip(ax[0].get_legend_handles_labels(), ax[1].get_legend_handles_labels())]
@@ -251,17 +264,11 @@ class DataSelector(ttk.Frame):
     def __init__(self, master, freeplotpane, idx, modifier):
         if DataSelector.first:
             DataSelector.first = False
-            DataSelector.compatible_datanames = []
-            datatypes = DataTypeMap.copy()
-            while(len(datatypes.keys())):
-                base_type = datatypes.pop(list(datatypes.keys())[0])
-                compatible_names = [base_type.name]
-                for key in list(datatypes.keys()):
-                    ref_type = datatypes[key]
-                    if units.validate_units(base_type.unit,ref_type.unit):
-                        compatible_names.append(ref_type.name)
-                        datatypes.pop(key)
-                DataSelector.compatible_datanames.append(compatible_names)
+            compatible_names = {} # group data types by the dimension of their units, invalid units on their own
+            for key, datatype in DataTypeMap.items():
+                dimension = units.get_dimension(datatype.unit)
+                compatible_names.setdefault(key if dimension is None else dimension, []).append(datatype.name)
+            DataSelector.compatible_datanames = list(compatible_names.values())
 
         self.idx = idx
         self.freeplotpane = freeplotpane
@@ -316,6 +323,16 @@ class DataSelector(ttk.Frame):
         self.freeplotpane.update(self.idx)
 
 
+def has_datatype(data,datatype):
+    ''' Returns True if datatype can be plotted from data, fetching it if needed. Data types that weren't extracted
+        when a run happened in another process (or came from the cache) can't be fetched afterwards. '''
+    try:
+        data[datatype]
+        return True
+    except KeyError:
+        print(DataTypeMap[datatype].name + " wasn't kept for this run, run the sim again to plot it.")
+        return False
+
 def update_listbox(lb,new_options):
     lb.delete(0,'end')
     for string in new_options:
@@ -0,0 +1,221 @@
+'''
+ORKPlusCLI:
+
+Headless command line interface to ORKPlus, for running simulations without the GUI (e.g. nightly dispersion
+campaigns on a server without a display). Output statistics are written as JSON or CSV, and the kept iterations'
+timeseries as a compressed .npz archive. Parameter sweeps over launch conditions write a CSV table.
+
+Example:
+    python ORKPlusCLI.py run OlympusTestRocket-Current.ork --sims 0 "Windy Day" --iterations 500 --seed 1 --workers 8
+                          --stats stats.json --timeseries runs.npz
+    python ORKPlusCLI.py sweep OlympusTestRocket-Current.ork --grid windspeed_avg=0:10:1 launchrod_ang=0,3,6 --out limits.csv
+    python ORKPlusCLI.py serve --workers 8 --preload OlympusTestRocket-Current.ork   (then add --server localhost:6789 to runs)
+'''
+
+import os
+import sys
+import csv
+import json
+import argparse
+import numpy as np
+import orhelper
+
+from . import orhelperhelper as orhh
+from .Sim import Sim
+from .SimCache import SimCache
+from .Sweep import ParameterSweep
+from .SimServer import SimServer, SimClient, SERVER_ENV, DEFAULT_ADDRESS
+from .Profiler import Profiler
+from . import metrics
+from orhelper import FlightDataType
+
+def select_sims(sim_names, selections):
+    ''' Returns the indices of the simulations picked by selections, each a simulation name or index. All if selections is empty. '''
+    if not selections:
+        return list(range(len(sim_names)))
+    indices = []
+    for selection in selections:
+        if selection in sim_names:
+            indices.append(sim_names.index(selection))
+        elif selection.isdigit() and int(selection) < len(sim_names):
+            indices.append(int(selection))
+        else:
+            raise ValueError("No simulation named or numbered " + selection + ", the simulations are: " + ', '.join(sim_names))
+    return indices
+
+def output_stats(sim):
+    ''' Returns a row of statistics for each of the outputs of a sim that has been run. '''
+    rows = []
+    for output in sim.outputs:
+        rows.append({'sim':sim.name, 'motor':sim.motor, 'output':output.name, 'unit':output.unit,
+                     'mean':float(output.mean), 'stddev':float(output.stddev), 'min':float(output.min),
+                     'max':float(output.max), 'count':int(output.count), 'iterations':sim.num_iters})
+    return rows
+
+def write_stats(path, rows):
+    ''' Write output statistics rows to path, as CSV if it ends in .csv and JSON otherwise. '''
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+def timeseries_arrays(sim, dtype=np.float64):
+    ''' Returns the kept iterations of a sim as a dict of named arrays, '<sim index>/<iteration>/<data type or event>'.
+        Includes the FlightDataTypes that were extracted and every derived metric. '''
+    arrays = {}
+    for data, events, iteration in zip(sim.data, sim.events, sim.kept):
+        prefix = str(sim.idx) + '/' + str(iteration) + '/'
+        datatypes = [x for x in data.keys() if isinstance(x, FlightDataType)] + list(metrics.registry.keys())
+        for datatype in datatypes:
+            arrays[prefix + getattr(datatype, 'name', str(datatype))] = np.asarray(data[datatype], dtype=dtype)
+        for event, times in events.items():
+            arrays[prefix + 'events/' + event.name] = np.asarray(times, dtype=np.float64)
+    return arrays
+
+def decimation(args):
+    ''' Returns the Sim.decimation settings picked by the --decimate-* arguments. '''
+    settings = {'every':args.decimate_every, 'interval':args.decimate_interval, 'tolerance':args.decimate_tolerance}
+    return {name:value for name, value in settings.items() if value is not None}
+
+def list_simulations(args):
+    ''' Returns the simulations in args.ork_file as a dict of name to motor, from the server if there is one. '''
+    if args.server:
+        with SimClient(args.server) as client:
+            return client.simulations(args.ork_file)
+    with orhelper.OpenRocketInstance(args.jar) as instance:
+        return orhh.get_simulations(orhh.load_doc(orhelper.Helper(instance), args.ork_file))
+
+def run(args):
+    if args.server: # the server's workers run every iteration, no need to start a JVM here
+        run_sims(args, None, None, list_simulations(args))
+        return
+    with orhelper.OpenRocketInstance(args.jar) as instance:
+        orh = orhelper.Helper(instance)
+        run_sims(args, instance, orh, orhh.get_simulations(orhh.load_doc(orh, args.ork_file)))
+
+def run_sims(args, instance, orh, sims):
+    profiler = Profiler() if args.profile else None
+    sim_names = list(sims.keys())
+    cache = SimCache(args.cache) if args.cache else None
+    stats = []
+    arrays = {}
+    for idx in select_sims(sim_names, args.sims):
+        print("Running " + sim_names[idx] + " - " + sims[sim_names[idx]])
+        sim = Sim(instance, orh, args.ork_file, idx, sim_names[idx], sims[sim_names[idx]])
+        sim.seed = args.seed
+        sim.cache = cache
+        sim.fetch_all = args.all_data
+        sim.keep_trajectories = args.keep
+        sim.sample_trajectories = args.sample
+        sim.decimation = decimation(args)
+        sim.profiler = profiler
+        sim.server = args.server
+        sim.jar_path = args.jar
+        sim.run(args.iterations, workers=args.workers, stream=True if args.stream else None)
+        stats += output_stats(sim)
+        if args.timeseries:
+            arrays.update(timeseries_arrays(sim, np.float32 if args.float32 else np.float64))
+
+    for row in stats:
+        print(row['sim'] + ' | ' + row['output'] + ': ' + str(round(row['mean'],3)) + ' +/- ' + str(round(row['stddev'],3)) + ' ' + row['unit'])
+    if args.stats and stats:
+        write_stats(args.stats, stats)
+    if args.timeseries:
+        np.savez_compressed(args.timeseries, **arrays)
+    if profiler is not None:
+        print(profiler.summary())
+        profiler.dump(args.profile)
+
+def parse_grid(specs):
+    ''' Parse grid specs like 'windspeed_avg=0:10:2' (start:stop:step, inclusive) or 'launchrod_ang=0,3,6' into a dict. '''
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if values == '':
+            raise ValueError("Grid spec " + spec + " should look like name=start:stop:step or name=v1,v2,...")
+        if ':' in values:
+            start, stop, step = [float(x) for x in values.split(':')]
+            grid[name] = [float(x) for x in np.arange(start, stop + step/2, step)]
+        else:
+            grid[name] = [float(x) for x in values.split(',')]
+    return grid
+
+def sweep(args):
+    grid = parse_grid(args.grid)
+    sims = list_simulations(args)
+    sim_names = list(sims.keys())
+    indices = select_sims(sim_names, args.sims)
+    labels = {idx: {'name':sim_names[idx], 'motor':sims[sim_names[idx]]} for idx in indices}
+    param_sweep = ParameterSweep(args.ork_file, grid, indices, args.iterations, args.seed, labels)
+    print("Sweeping " + str(len(param_sweep.points())) + " grid points")
+    param_sweep.run(args.workers, progress=lambda done, total: print("Finished sweep job " + str(done) + " of " + str(total)),
+                    server=args.server, jar_path=args.jar)
+    if args.out:
+        param_sweep.write_csv(args.out)
+    else:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(param_sweep.rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(param_sweep.rows)
+
+def serve(args):
+    SimServer(args.address, args.workers, args.preload, args.jar).serve_forever()
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='ORKPlusCLI', description='Run OpenRocket simulations without the ORKPlus GUI.')
+    parser.add_argument('--jar', default=os.environ.get('CLASSPATH', 'OpenRocket-15.03.jar'), help='OpenRocket .jar to use (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run simulations, optionally as a Monte Carlo dispersion study')
+    run_parser.add_argument('ork_file', help='OpenRocket document')
+    run_parser.add_argument('--sims', nargs='*', help='names or indices of the simulations to run (default: all)')
+    run_parser.add_argument('--iterations', type=int, default=1, help='Monte Carlo iterations per simulation')
+    run_parser.add_argument('--seed', default=None, help='seed for the random parameter variations, makes runs repeatable')
+    run_parser.add_argument('--workers', type=int, default=1, help='worker processes to run iterations on')
+    run_parser.add_argument('--stream', action='store_true', help='stream output statistics, keeping only --keep trajectories')
+    run_parser.add_argument('--keep', type=int, default=10, help='trajectories kept when streaming (default: %(default)s)')
+    run_parser.add_argument('--sample', action='store_true', help='keep a random sample of trajectories instead of the first ones')
+    run_parser.add_argument('--all-data', action='store_true', help='keep every flight data type, not just those the outputs use')
+    run_parser.add_argument('--cache', default=None, help='directory to cache seeded results in')
+    decimate = run_parser.add_mutually_exclusive_group()
+    decimate.add_argument('--decimate-every', type=int, default=None, help='keep only every Nth step of each iteration')
+    decimate.add_argument('--decimate-interval', type=float, default=None, help='keep one step per this many seconds')
+    decimate.add_argument('--decimate-tolerance', type=float, default=None,
+                          help='keep a step only when a derived metric (damping ratio, natural frequency, ...) has changed by more than this fraction')
+    run_parser.add_argument('--stats', default=None, help='file to write output statistics to (.json or .csv)')
+    run_parser.add_argument('--timeseries', default=None, help='.npz file to write kept timeseries to')
+    run_parser.add_argument('--profile', default=None, help='.json file to write a timing report of the run to: per phase and listener step statistics, and the phase times of the slowest iterations')
+    run_parser.add_argument('--float32', action='store_true', help='write timeseries as float32 to halve their size')
+    run_parser.add_argument('--server', default=os.environ.get(SERVER_ENV), help='address of a running server to run iterations on (default: $' + SERVER_ENV + ')')
+    run_parser.set_defaults(func=run)
+
+    sweep_parser = commands.add_parser('sweep', help='run a grid of launch conditions over one or more simulations')
+    sweep_parser.add_argument('ork_file', help='OpenRocket document')
+    sweep_parser.add_argument('--grid', nargs='+', required=True,
+                              help='launch conditions to sweep, e.g. windspeed_avg=0:10:2 launchrod_ang=0,3,6 '
+                                   '(launchrod_ang, launchrod_dir in deg, windspeed_avg in m/s, windturb_int)')
+    sweep_parser.add_argument('--sims', nargs='*', help='names or indices of the simulations (motor configurations) to sweep (default: all)')
+    sweep_parser.add_argument('--iterations', type=int, default=1, help='Monte Carlo iterations per grid point (default: 1, unvaried)')
+    sweep_parser.add_argument('--seed', default=None, help='seed for the random parameter variations')
+    sweep_parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    sweep_parser.add_argument('--out', default=None, help='CSV file to write the results table to (default: stdout)')
+    sweep_parser.add_argument('--server', default=os.environ.get(SERVER_ENV), help='address of a running server to run the sweep on (default: $' + SERVER_ENV + ')')
+    sweep_parser.set_defaults(func=sweep)
+
+    serve_parser = commands.add_parser('serve', help='keep warm OpenRocket workers running for other runs to use')
+    serve_parser.add_argument('--address', default=DEFAULT_ADDRESS[0] + ':' + str(DEFAULT_ADDRESS[1]), help='host:port to listen on (default: %(default)s)')
+    serve_parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    serve_parser.add_argument('--preload', nargs='*', default=[], help='OpenRocket documents for the workers to load on startup')
+    serve_parser.set_defaults(func=serve)
+    return parser
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except (ValueError, KeyError, FileNotFoundError) as e:
+        print('error: ' + str(e), file=sys.stderr)
+        sys.exit(1)
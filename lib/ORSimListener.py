@@ -1,34 +1,41 @@
+import time
+import jpype
 import orhelper
 from lib import orhelperhelper as orhh
 import numpy as np
-import matplotlib.pyplot as plt
-from random import gauss
-from tkinter import filedialog
 from orhelper import FlightDataType, FlightEvent, JIterator
-from .orhelperhelper import ExtendedDataType
-import tkinter as tk
-from tkinter import ttk
+from .orhelperhelper import ListenerDataType
+from .ColumnBuffer import ColumnBuffer
+from .SimResults import RunData
+from . import metrics
 
 
 class ORSimListener(orhelper.AbstractSimulationListener):
     ''' ORSimListener < AbstractSimulationListener
-    A simulation listener for runs of an OpenRocket simulation. 
+    A simulation listener for runs of an OpenRocket simulation.
 
-    Calculates desirable values during runtime after each timestep.
+    Captures the raw inputs needed for the desirable values after each timestep, so each step makes as few Java calls as
+    possible. After the flight, they're reduced to the per-step inputs of the derived values (ListenerDataTypes, see
+    get_results), and the values themselves are computed from those when they're first used (see metrics).
 
     TODO: Make this also adjust the wind model to match local launchsite data.
     '''
-    def __init__(self, sim, rocket):
-        self.results = {ExtendedDataType.TYPE_DAMPING_COEFF:[],
-                        ExtendedDataType.TYPE_DAMPING_RATIO:[],
-                        ExtendedDataType.TYPE_CORRECTIVE_COEFF:[],
-                        ExtendedDataType.TYPE_NATURAL_FREQUENCY:[],
-                        ExtendedDataType.TYPE_DYNAMIC_PRESSURE:[],
-                        ExtendedDataType.TYPE_FLUTTER_VELOCITY:[],
-                        ExtendedDataType.TYPE_CHAR_OSCILLATION_DISTANCE:[],
-                        ExtendedDataType.TYPE_FLUTTER_VELOCITY_CF:[],
-                        ExtendedDataType.TYPE_FLUTTER_VELOCITY_FG:[],
-                        }
+    # raw per-step inputs captured during the flight, one row of self.raw each
+    RAW_FIELDS = ['time', 'in_flight', # 1 in the air-stabilized ascent phase (launch rod cleared, apogee not reached), else 0
+                  'motor_mass', 'pres', 'soundspeed', 'dens', 'area_ref', 'vel', 'I_long', 'cg']
+    INITIAL_STEPS = 1024 # initial capacity of self.raw, doubled whenever it fills up
+
+    def __init__(self, sim, rocket, dtype=np.float64, every=None, interval=None, tolerance=None, timed=False):
+        ''' dtype: numpy dtype of the results, np.float32 halves their memory. The raw inputs are always float64.
+            Results can be decimated to fewer steps, keeping the first and last steps and the steps either side of every
+            flight event, by at most one of:
+                every: keep every Nth step
+                interval: keep the first step in each interval of this many seconds
+                tolerance: keep a step when any derived metric computed from the results (damping ratio, natural frequency,
+                           ..., see metrics) has changed by more than this fraction since the last kept step
+            The inputs are still captured every step, so the results at the kept steps are the same as without decimation.
+            timed: record the wall time of each step in self.step_times, see Profiler
+        '''
         self.rocket = rocket
         self.x_ne = rocket.getLength()
         self.timestep = sim.getOptions().getTimeStep()
@@ -40,13 +47,38 @@ class ORSimListener(orhelper.AbstractSimulationListener):
         self.mass_calc = None
         self.aero_calc = None
         self.flight_conds = None
-        self.last_motor_mass = 0
-        self.last_time = 0
+        self.dtype = dtype
+        self.raw = ColumnBuffer(self.RAW_FIELDS, self.INITIAL_STEPS)
+        # CP and CNa of each aerodynamic component per step, a column per component in self.component_columns
+        self.comp_cp = ColumnBuffer([], self.INITIAL_STEPS)
+        self.comp_cna = ColumnBuffer([], self.INITIAL_STEPS)
+        self.component_columns = {} # every component seen in the force analysis -> its column in comp_cp/comp_cna
+        self.stage_components = [] # (component, column) of the components in the current stage's force analysis
+        self.stage_keys = None # copy of the force analysis' component set that stage_components was built from
+        self.results = None # ColumnBuffer with a column per ListenerDataType, filled in by compute_results
+        self.every = every
+        self.interval = interval
+        self.tolerance = tolerance
+        self.event_times = [] # times of the flight events, the steps around them are kept when decimating
+        self.kept = None # indices of the steps kept in the results
+        self.step_times = []
+        if timed: # shadow postStep with a timed version, so untimed runs don't pay for the timing
+            untimed_step = self.postStep
+            def postStep(status):
+                start = time.perf_counter()
+                result = untimed_step(status)
+                self.step_times.append(time.perf_counter() - start)
+                return result
+            self.postStep = postStep
 
     def postFlightConditions(self, status, flight_conds):
         self.flight_conds = flight_conds
         return super().postFlightConditions(status,flight_conds)
 
+    def handleFlightEvent(self, status, flight_event):
+        self.event_times.append(float(flight_event.getTime()))
+        return super().handleFlightEvent(status, flight_event)
+
     def postStep(self, status):
         if self.sim_conds is None:
             self.sim_conds = status.getSimulationConditions()
@@ -57,82 +89,142 @@ class ORSimListener(orhelper.AbstractSimulationListener):
             self.motor_instance = self.motor_config.getMotorInstance(motor_id)
             self.mass_calc = self.sim_conds.getMassCalculator()
             self.aero_calc = self.sim_conds.getAerodynamicCalculator()
-        
-        sim_wngs = status.getWarnings()        
-        force_analysis = dict(self.aero_calc.getForceAnalysis(self.sim_config, self.flight_conds, sim_wngs))
-        reached_apogee = status.isApogeeReached()
-        launchrod_cleared = status.isLaunchRodCleared()
+
+        row = self.raw.append_row()
+        cp_row = self.comp_cp.append_row()
+        cna_row = self.comp_cna.append_row()
+        row[0] = float(status.getSimulationTime())
+
+        # propellant mass is needed every step for the backwards Euler mass flow rate
+        row[2] = float(self.mass_calc.getPropellantMass(self.sim_config, self.motor_config))
 
         # TODO - check for launchrod clear and apogee, store values as Nan
-        if launchrod_cleared and not(reached_apogee):
+        if status.isLaunchRodCleared() and not(status.isApogeeReached()):
+            # Rocket conditions
+            force_analysis = self.aero_calc.getForceAnalysis(self.sim_config, self.flight_conds, status.getWarnings())
+            components = force_analysis.keySet()
+            if self.stage_keys is None or not self.stage_keys.equals(components): # first step in the air, or a stage separated
+                self.index_components(force_analysis)
+                cp_row = self.comp_cp.columns()[:,-1] # the rows grow if index_components added columns
+                cna_row = self.comp_cna.columns()[:,-1]
+            for comp, col in self.stage_components:
+                forces = force_analysis.get(comp)
+                comp_cp = forces.getCP()
+                if comp_cp is not None:
+                    cp_row[col] = float(comp_cp.length())
+                    cna_row[col] = float(forces.getCNa())
+
             # Atmospheric conditions
             atm_conds = self.flight_conds.getAtmosphericConditions()
-            pres = float(atm_conds.getPressure())
-            soundspeed = float(atm_conds.getMachSpeed())
-            dens = float(atm_conds.getDensity())
-
-            # Rocket conditions
-            area_ref = float(self.flight_conds.getRefArea())
-            cps = [] # list of CPs for each aerodynamic component
-            cnas = [] # list of CNas for eacha aerodynamic component
-            for comp in force_analysis.keys():
-                if force_analysis[comp].getCP() is not None:
-                    cps.append(float(force_analysis[comp].getCP().length()))
-                    cnas.append(float(force_analysis[comp].getCNa()))
-            motor_mass = float(self.mass_calc.getPropellantMass(self.sim_config, self.motor_config))
-            prop_mdot = (self.last_motor_mass - motor_mass)/self.timestep # backwards Euler derivative
-            cp = sum(cps) # total rocket Cp
-            cna = sum(cnas) # total rocket CNa
-            vel = float(self.flight_conds.getVelocity()) # velocity of rocket
-            I_long = float(self.mass_calc.getLongitudinalInertia(self.sim_config, self.motor_config)) # longitudinal inertia of rocket
-            cg = float(self.rocket.getCG().length()) # center of gravity of rocket
-
-            ''' Update stored values'''
-            self.last_motor_mass = motor_mass
-
-            ''' Calculate new data values. '''
-            C1 = 0.5*dens*(vel**2)*area_ref*cna*(cp-cg) # Corrective moment coefficient
-            C2R = prop_mdot*(self.x_ne-cg)**2 # Propulsive damping coefficient
-            C2A = 0.5*dens*vel*area_ref*sum([(cna_x-cg)**2 for cna_x in cnas]) # Aerodynamic damping coefficient
-            C2 = np.add(C2R,C2A) # Damping coefficient
-            DR = C2/(2*np.sqrt(C1*I_long)) # Damping Ratio
-            NF = np.sqrt(C1/I_long)  #Natural frequency, Hz 
-            COD = NF/vel # Characteristic oscillation distance, 1/m
-            Q = 0.5*dens*(vel**2) # Dynamic pressure
-            VF = soundspeed*self.vf_coeff/np.sqrt(pres) # fin flutter velocity with unity shear modulus, m/s
-            safety_factor = 10 # safety factor on shear moduli for orthotropic consideration
-            VF_CF = VF*np.sqrt(1E10/safety_factor) # fin flutter velocity with shear modulus of carbon fiber, ~10GPa
-            VF_FG = VF*np.sqrt(3E10/safety_factor) # fin flutter velocity with shear modulus of fiber glass, ~30GPa
-        
+            row[1] = 1
+            row[3] = float(atm_conds.getPressure())
+            row[4] = float(atm_conds.getMachSpeed())
+            row[5] = float(atm_conds.getDensity())
+            row[6] = float(self.flight_conds.getRefArea())
+            row[7] = float(self.flight_conds.getVelocity()) # velocity of rocket
+            row[8] = float(self.mass_calc.getLongitudinalInertia(self.sim_config, self.motor_config)) # longitudinal inertia of rocket
+            row[9] = float(self.rocket.getCG().length()) # center of gravity of rocket
         else:
-            ''' If not in air-stabilized ascent phase, append NaN. '''
-            self.last_motor_mass = float(self.mass_calc.getPropellantMass(self.sim_config, self.motor_config))
-            C1 = np.nan # Corrective moment coefficient
-            C2R = np.nan # Propulsive damping coefficient
-            C2A = np.nan # Aerodynamic damping coefficient
-            C2 = np.nan # Damping coefficient
-            DR = np.nan # Damping Ratio
-            NF = np.nan #Natural frequency 
-            COD = np.nan # Characteristic oscillation distance
-            Q = np.nan # Dynamic pressure
-            VF = np.nan # fin flutter velocity with unity shear modulus
-            VF_CF = np.nan
-            VF_FG = np.nan
-
-        self.results[ExtendedDataType.TYPE_DAMPING_COEFF].append(C2)
-        self.results[ExtendedDataType.TYPE_DAMPING_RATIO].append(DR)
-        self.results[ExtendedDataType.TYPE_CORRECTIVE_COEFF].append(C1)
-        self.results[ExtendedDataType.TYPE_NATURAL_FREQUENCY].append(NF)
-        self.results[ExtendedDataType.TYPE_CHAR_OSCILLATION_DISTANCE].append(COD)
-        self.results[ExtendedDataType.TYPE_DYNAMIC_PRESSURE].append(Q)
-        self.results[ExtendedDataType.TYPE_FLUTTER_VELOCITY].append(VF)
-        self.results[ExtendedDataType.TYPE_FLUTTER_VELOCITY_CF].append(VF_CF)
-        self.results[ExtendedDataType.TYPE_FLUTTER_VELOCITY_FG].append(VF_FG)
+            row[1] = 0
 
         return super().postStep(status)
-    
-    def get_results(self): 
-        # return dict of results in order of type enumeration
-        return self.results
 
+    def index_components(self, force_analysis):
+        ''' Build the index of the aerodynamic components in force_analysis, so each step only looks up their forces
+            instead of going through the whole map. The components are fixed within a stage, but a stage separation can
+            swap them for as many others, so the index is rebuilt whenever the set of components changes, not its size. '''
+        self.stage_components = []
+        for comp in force_analysis.keySet():
+            if comp not in self.component_columns:
+                self.component_columns[comp] = self.comp_cp.add_column(len(self.component_columns))
+                self.comp_cna.add_column(len(self.component_columns)-1)
+            self.stage_components.append((comp, self.component_columns[comp]))
+        self.stage_keys = jpype.JClass('java.util.HashSet')(force_analysis.keySet())
+
+    def compute_results(self):
+        ''' Calculate the per-step inputs of the derived metrics for the whole flight in one vectorized pass over the
+            captured values. Steps outside of the air-stabilized ascent phase are NaN. Returns a ColumnBuffer of the
+            results, a column per ListenerDataType. '''
+        time, in_flight, motor_mass, pres, soundspeed, dens, area_ref, vel, I_long, cg = self.raw.columns()
+        comp_cna = self.comp_cna.columns() # (components x steps), NaN where a component had no CP
+
+        last_motor_mass = np.concatenate(([0.0], motor_mass[:-1]))
+        prop_mdot = (last_motor_mass - motor_mass)/self.timestep # backwards Euler derivative
+
+        values = {ListenerDataType.TYPE_PROPELLANT_MASS_FLOW:prop_mdot,
+                  ListenerDataType.TYPE_AIR_PRESSURE:pres,
+                  ListenerDataType.TYPE_SPEED_OF_SOUND:soundspeed,
+                  ListenerDataType.TYPE_AIR_DENSITY:dens,
+                  ListenerDataType.TYPE_REFERENCE_AREA:area_ref,
+                  ListenerDataType.TYPE_VELOCITY:vel,
+                  ListenerDataType.TYPE_LONGITUDINAL_INERTIA:I_long,
+                  ListenerDataType.TYPE_CG_LOCATION:cg,
+                  ListenerDataType.TYPE_CP_SUM:np.nansum(self.comp_cp.columns(), axis=0), # total rocket Cp
+                  ListenerDataType.TYPE_CNA_SUM:np.nansum(comp_cna, axis=0), # total rocket CNa
+                  ListenerDataType.TYPE_CNA_CG_SQ_SUM:np.nansum((comp_cna-cg)**2, axis=0), # for the aerodynamic damping coefficient
+                  ListenerDataType.TYPE_ROCKET_LENGTH:self.x_ne,
+                  ListenerDataType.TYPE_FLUTTER_COEFF:self.vf_coeff,
+                  }
+        all_steps = np.empty((len(ListenerDataType), len(time)))
+        for i, datatype in enumerate(ListenerDataType):
+            all_steps[i] = values[datatype]
+        ''' If not in air-stabilized ascent phase, NaN. '''
+        all_steps[:,in_flight != 1] = np.nan
+
+        self.kept = self.kept_steps(time, self.metric_steps(all_steps) if self.tolerance is not None else None)
+        results = ColumnBuffer(ListenerDataType, len(self.kept), self.dtype)
+        results.append_rows(len(self.kept))[:] = all_steps[:,self.kept]
+        return results
+
+    def metric_steps(self, all_steps):
+        ''' The (metrics x steps) values of the derived metrics that can be computed from the (results x steps) values,
+            which tolerance decimation compares. The raw results aren't compared: they include constants, like the
+            rocket length and flutter coefficient, and small changes in them can be large changes in the metrics. '''
+        data = RunData(zip(ListenerDataType, all_steps))
+        keys = metrics.computable_from(ListenerDataType)
+        return np.array([np.broadcast_to(data[key], all_steps.shape[1:]) for key in keys]).reshape(len(keys), -1)
+
+    def kept_steps(self, time, values):
+        ''' Indices of the steps kept by the decimation settings, given the step times and, for tolerance decimation,
+            the (metrics x steps) values compared, see metric_steps. '''
+        num_steps = len(time)
+        if self.every is None and self.interval is None and self.tolerance is None:
+            return np.arange(num_steps)
+        keep = np.zeros(num_steps, dtype=bool)
+        if self.every is not None:
+            keep[::max(1, int(self.every))] = True
+        elif self.interval is not None:
+            bins = np.floor((time - time[0])/self.interval)
+            keep[1:] = bins[1:] != bins[:-1]
+        else:
+            last = values[:,0]
+            for i in range(1, num_steps): # sequential, each step is compared against the last one kept
+                step = values[:,i]
+                with np.errstate(invalid='ignore'):
+                    changed = (np.isnan(step) != np.isnan(last)) | (np.abs(step - last) > self.tolerance*np.abs(last))
+                if changed.any():
+                    keep[i] = True
+                    last = step
+        if num_steps > 0:
+            keep[[0, -1]] = True
+            for t_event in self.event_times: # the steps either side of the event
+                idx = np.searchsorted(time, t_event)
+                keep[max(idx-1, 0):min(idx+1, num_steps)] = True
+        return np.flatnonzero(keep)
+
+    def decimated(self):
+        ''' True if the results don't have every step, see get_rows. '''
+        self.get_results()
+        return len(self.kept) < len(self.raw)
+
+    def get_rows(self, branch_time):
+        ''' Rows of a flight data branch matching the kept steps, given the branch's times. '''
+        self.get_results()
+        kept_times = self.raw.column('time')[self.kept]
+        return np.clip(np.searchsorted(branch_time, kept_times), 0, len(branch_time)-1)
 
+    def get_results(self):
+        # return dict of results in order of type enumeration, as views of one (types x steps) buffer
+        if self.results is None:
+            self.results = self.compute_results()
+        return self.results.views()
@@ -125,6 +125,10 @@ class PlotPane(ttk.Notebook):
     def update_sim(self,newsim):
         self.sim = newsim
 
+    def get_datatypes(self):
+        ''' Returns every data type plotted on any page. '''
+        return [datatype for page in self.datatypes for keys in page for datatype in keys]
+
     def update_all(self):
         for i in range(len(self.names)):
             self.update(i)
@@ -165,11 +169,10 @@ class PlotPane(ttk.Notebook):
         data = self.sim.data[0]
         colors = [ax1_color, ax2_color]
         for i in [0, 1]:
-            from_unit = DataTypeMap[self.datatypes[index][i][0]].unit
             to_unit = self.selectors[index][i].get()
             for j in range(len(self.datatypes[index][i])):
                 datatype = self.datatypes[index][i][j]
-                plotdata = units.convert(data[datatype], from_unit, to_unit)
+                plotdata = data.in_unit(datatype, to_unit)
                 ax[i].plot(data[FlightDataType.TYPE_TIME], plotdata,color=colors[i],label=DataTypeMap[datatype].name,linestyle=linestyle_tuple[j])
                 ylabs[i].append(DataTypeMap[datatype].name)
             ax[i].set_ylabel(','.join(ylabs[i])+', '+to_unit,color=colors[i])
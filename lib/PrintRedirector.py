@@ -8,24 +8,43 @@ Setting sys.stdout = PrintRedirector() will cause all print statements to be wri
 
 __enter__ and __exit__ allow this object to be called using a with... as... : framework, and ensures the logfile is closed 
 when the program ends.
+
+tkinter isn't thread-safe, so messages printed from other threads (e.g. a SimRunner) are queued and written by the
+main thread the next time it polls.
 '''
 
+import queue
+import threading
 import tkinter as tk
 from tkinter import scrolledtext as stxt
 from io import StringIO as StringIO
 
 NUM_LINES = 30
+POLL_MS = 50 # how often queued messages from other threads are written, ms
 
 class PrintRedirector(stxt.ScrolledText):
     def __init__(self, master):
         super().__init__(master=master, wrap='word', font = ('Courier New',11), foreground='white', background='black',relief='sunken',height=1)
         self['state'] = 'disabled'
+        self.pending = queue.Queue() # messages written from other threads
+        self.after(POLL_MS,self.poll)
 
     def check_range(self):
         if float(self.index("end-1c")) == NUM_LINES+2:
             self.delete("1.0", "1.end + 1 char")
 
+    def poll(self):
+        while True:
+            try:
+                self.write(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        self.after(POLL_MS,self.poll)
+
     def write(self, msg):
+        if threading.current_thread() is not threading.main_thread():
+            self.pending.put(msg)
+            return
         self['state'] = 'normal'
         if msg == 'clc' or isinstance(msg, int):
             self.delete("1.0", "end+1c") # clear on these cues
@@ -0,0 +1,151 @@
+'''
+Profiler:
+
+Wall time instrumentation for simulation runs. A Sim with a Profiler attached records how long each phase of a run
+takes (loading the document, OpenRocket's simulation, transferring data out of the JVM, evaluating outputs, ...) and
+how long each of the listener's steps takes, and reports them as a JSON-serializable dict or a printable summary.
+
+A long run's profile stays the same size however many iterations and steps it has: each phase keeps its count, total,
+min and max, the listener's step times go into a fixed histogram, and the phase times of each iteration are kept only
+for the ITERATIONS_KEPT slowest iterations, so the slow ones can still be found.
+
+Profiling is off unless a Profiler is attached (Sim.profiler), and costs nothing then: phases are timed through a
+shared no-op context and the listener's postStep isn't wrapped at all.
+'''
+
+import json
+import time
+import heapq
+import contextlib
+import numpy as np
+
+NO_PROFILER = contextlib.nullcontext() # shared no-op phase, for code that runs without a profiler
+
+STEP_EDGES = np.geomspace(1e-7, 10.0, 71) # edges of the listener step time histogram, s, 10 log-spaced bins per decade
+ITERATIONS_KEPT = 100 # number of the slowest iterations whose phase times are kept, see Profiler.iteration
+
+class Profiler:
+    def __init__(self):
+        self.timings = {} # phase -> [count, total, min, max] of its wall times, s
+        self.step_counts = np.zeros(len(STEP_EDGES) - 1, dtype=np.int64) # histogram of listener step times, see STEP_EDGES
+        self.steps = [0, 0.0, np.inf, 0.0] # count, total, min, max of the listener step times, s
+        self.iterations = [] # heap of (total, order, label, phase -> s) of the ITERATIONS_KEPT slowest iterations
+        self.num_iterations = 0 # number of iterations timed
+        self.current = None # phase -> s of the iteration being timed, see iteration
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        ''' Context manager timing a phase, e.g. with profiler.phase('load'): ... '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def iteration(self, label):
+        ''' Context manager timing an iteration, e.g. with profiler.iteration('sim iteration 3'): ... The phases that run
+            inside it are recorded as that iteration's too, see report. '''
+        self.current = {}
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases, self.current = self.current, None
+            self.add_iteration(time.perf_counter() - start, label, phases)
+
+    def add_iteration(self, total, label, phases):
+        ''' Record an iteration's total time and phase -> time, keeping only the ITERATIONS_KEPT slowest. '''
+        entry = (total, self.num_iterations, label, phases) # the order breaks ties, so phases are never compared
+        self.num_iterations += 1
+        if len(self.iterations) < ITERATIONS_KEPT:
+            heapq.heappush(self.iterations, entry)
+        else:
+            heapq.heappushpop(self.iterations, entry)
+
+    def add(self, name, seconds):
+        if self.current is not None:
+            self.current[name] = self.current.get(name, 0.0) + seconds
+        self.merge_stats(self.timings.setdefault(name, [0, 0.0, np.inf, 0.0]), [1, seconds, seconds, seconds])
+
+    def add_steps(self, step_times):
+        ''' Record the listener step times of an iteration, and their total as the 'listener' phase. Only their statistics
+            and histogram are kept, so a long run's profile stays the same size however many steps it takes. '''
+        step_times = np.asarray(step_times, dtype=np.float64)
+        total = float(step_times.sum())
+        if len(step_times) > 0:
+            self.step_counts += np.histogram(np.clip(step_times, STEP_EDGES[0], STEP_EDGES[-1]), bins=STEP_EDGES)[0]
+            self.merge_stats(self.steps, [len(step_times), total, float(step_times.min()), float(step_times.max())])
+        self.add('listener', total)
+
+    @staticmethod
+    def merge_stats(stats, other):
+        ''' Fold the [count, total, min, max] other into stats, in place. '''
+        stats[0] += other[0]
+        stats[1] += other[1]
+        stats[2] = min(stats[2], other[2])
+        stats[3] = max(stats[3], other[3])
+
+    def get_state(self):
+        ''' Returns the recorded timings, to send them from a worker process, see merge. '''
+        return {'timings':self.timings, 'step_counts':self.step_counts.tolist(), 'steps':self.steps,
+                'iterations':[[total, label, phases] for total, _, label, phases in self.iterations]}
+
+    def merge(self, state, label=None):
+        ''' Add the timings of another Profiler's get_state(). label, if given, replaces the labels of its iterations, e.g.
+            the iteration number of a job that a worker process timed. '''
+        for name, stats in state['timings'].items():
+            self.merge_stats(self.timings.setdefault(name, [0, 0.0, np.inf, 0.0]), stats)
+        self.step_counts += np.asarray(state['step_counts'], dtype=np.int64)
+        if state['steps'][0] > 0:
+            self.merge_stats(self.steps, state['steps'])
+        for total, iteration_label, phases in state['iterations']:
+            self.add_iteration(total, iteration_label if label is None else label, phases)
+
+    def step_percentile(self, q):
+        ''' Returns the q-th percentile of the listener step times, estimated from the histogram as the geometric middle
+            of the bin it falls in, which is within a bin's width (about 25%) of the exact value. '''
+        cumulative = np.cumsum(self.step_counts)
+        i = min(int(np.searchsorted(cumulative, q/100*cumulative[-1])), len(cumulative) - 1)
+        return float(np.clip(np.sqrt(STEP_EDGES[i]*STEP_EDGES[i+1]), self.steps[2], self.steps[3]))
+
+    def report(self):
+        ''' Returns the timings as a dict: per phase statistics, and statistics and a log-spaced histogram of the listener's step times. '''
+        phases = {}
+        for name, (count, total, least, most) in self.timings.items():
+            phases[name] = {'count':count, 'total':total, 'mean':total/count, 'min':least, 'max':most}
+        report = {'phases':phases}
+        count, total, least, most = self.steps
+        if count > 0:
+            used = np.flatnonzero(self.step_counts)
+            used = slice(used[0], used[-1] + 1) # the bins from the fastest step to the slowest
+            report['listener_steps'] = {'count':count, 'total':total, 'mean':total/count,
+                                        'p50':self.step_percentile(50), 'p99':self.step_percentile(99),
+                                        'min':least, 'max':most,
+                                        'histogram':{'edges':STEP_EDGES[used.start:used.stop+1].tolist(),
+                                                     'counts':self.step_counts[used].tolist()}}
+        if self.iterations:
+            report['slowest_iterations'] = [{'iteration':label, 'total':total, 'phases':phases}
+                                             for total, _, label, phases in sorted(self.iterations, reverse=True)]
+        return report
+
+    def dump(self, path):
+        ''' Write report() to path as JSON. '''
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        ''' Returns report() as text for the console. '''
+        report = self.report()
+        lines = ['Phase                 count    total (s)     mean (ms)']
+        for name, stats in sorted(report['phases'].items(), key=lambda item: -item[1]['total']):
+            lines.append('{:<20} {:>6} {:>12.3f} {:>13.3f}'.format(name, stats['count'], stats['total'], 1e3*stats['mean']))
+        if 'listener_steps' in report:
+            steps = report['listener_steps']
+            lines.append('Listener steps: {} steps, mean {:.1f} us, median {:.1f} us, 99th percentile {:.1f} us, max {:.1f} us'.format(
+                steps['count'], 1e6*steps['mean'], 1e6*steps['p50'], 1e6*steps['p99'], 1e6*steps['max']))
+        for iteration in report.get('slowest_iterations', [])[:3]:
+            phases = sorted(iteration['phases'].items(), key=lambda item: -item[1])
+            lines.append('Slow iteration: {} {:.3f} s ({})'.format(iteration['iteration'], iteration['total'],
+                         ', '.join('{} {:.3f} s'.format(name, seconds) for name, seconds in phases)))
+        return '\n'.join(lines)
@@ -1,16 +1,20 @@
-from audioop import mul
-from statistics import stdev
-import tkinter as tk
-from tkinter import ttk
+import os
 import numpy as np
-from random import gauss, uniform
+import random
 from lib import orhelperhelper as orhh
 import orhelper
 from orhelper import FlightDataType, FlightEvent
 from .orhelperhelper import ExtendedDataType, DataTypeMap, EventTypeMap
+from . import metrics # registers the derived metrics' data types, before the outputs below look up their units
 from .ORSimListener import ORSimListener
+from .SimPool import SimPool
+from .SimServer import SimClient, SERVER_ENV
+from .SimResults import AlignedResults, PaddedResults, RunData
+from .Profiler import NO_PROFILER
 from .units import units
 
+MAX_ITERATIONS = 100 # limit on iterations that keep every trajectory in memory, streamed runs aren't limited
+
 class SimOutput:
     def __init__(self,name,datatype,output_type='max',when='any'):
         ''' output_type can be 'max', 'min','avg', or 'at' (looks at when for an EventType).
@@ -22,40 +26,60 @@ class SimOutput:
         self.unit = DataTypeMap[datatype].unit
         self.output_type = output_type
         self.when = when
-        self.mean = 0
-        self.stddev = 0
+        self.clear()
 
     def clear(self):
         self.mean = 0
         self.stddev = 0
+        # running accumulators, updated one iteration at a time by push()
+        self.count = 0
+        self.min = np.nan
+        self.max = np.nan
+        self._run_mean = 0.0
+        self._run_m2 = 0.0
+
+    def evaluate(self,results):
+        ''' Returns the value of this output for every iteration in a SimResults.PaddedResults, as an array. '''
+        if self.output_type == 'at':
+            return results.at(self.datatype,self.when)
+        mask = results.before(FlightEvent.APOGEE) if self.when == 'ascent' else None
+        if self.output_type == 'min':
+            return results.reduce(np.nanmin,self.datatype,mask)
+        elif self.output_type == 'avg':
+            return results.reduce(np.nanmean,self.datatype,mask)
+        else:
+            return results.reduce(np.nanmax,self.datatype,mask)
+
+    def push(self,val):
+        ''' Add one iteration's value to the running statistics (Welford's algorithm), NaN values are skipped.
+            mean and stddev are kept current, so this can be used in place of update() when iterations are streamed. '''
+        if np.isnan(val):
+            return
+        self.count += 1
+        delta = val - self._run_mean
+        self._run_mean += delta/self.count
+        self._run_m2 += delta*(val - self._run_mean)
+        self.min = val if self.count == 1 else min(self.min,val)
+        self.max = val if self.count == 1 else max(self.max,val)
+        self.mean = self._run_mean
+        self.stddev = np.sqrt(self._run_m2/self.count) # population std. dev., same as np.nanstd
+
+    def get_state(self):
+        ''' Returns a snapshot of the output statistics that can be restored with set_state. '''
+        return (self.mean, self.stddev, self.count, self.min, self.max, self._run_mean, self._run_m2)
+
+    def set_state(self,state):
+        self.mean, self.stddev, self.count, self.min, self.max, self._run_mean, self._run_m2 = state
     
-    def update(self,data,events):
-        vals = []
-        for i in range(len(data)): # for each iteration
-            if self.output_type == 'at':
-                try:
-                    time_ind = np.where(data[i][FlightDataType.TYPE_TIME] == events[i][self.when][0])[0]
-                    if len(time_ind) > 1:
-                        time_ind = time_ind[0]
-                    elif len(time_ind) == 0:
-                        time_ind = -1
-                except:
-                    time_ind = -1
-            elif self.when == 'ascent':
-                time_ind = np.where(data[i][FlightDataType.TYPE_TIME] < events[i][FlightEvent.APOGEE][0])
-            else:
-                time_ind = range(len(data[0][FlightDataType.TYPE_TIME]))
-            if self.output_type == 'at':
-                val = data[i][self.datatype][time_ind]
-            elif self.output_type == 'min':
-                val = np.nanmin(np.take(data[i][self.datatype],time_ind))
-            elif self.output_type == 'avg':
-                val = np.nanmean(np.take(data[i][self.datatype],time_ind))
-            else:
-                val = np.nanmax(np.take(data[i][self.datatype],time_ind))
-            vals.append(val)
-        self.mean = np.nanmean(vals)
-        self.stddev = np.nanstd(vals)
+    def update(self,results):
+        ''' Recompute the output statistics from every iteration in a SimResults.PaddedResults. '''
+        vals = self.evaluate(results)
+        self.count = int(np.sum(~np.isnan(vals)))
+        self.mean = np.nanmean(vals) if self.count > 0 else np.nan
+        self.stddev = np.nanstd(vals) if self.count > 0 else np.nan
+        if self.count > 0:
+            self.min = np.nanmin(vals)
+            self.max = np.nanmax(vals)
 
 class Sim:
     # sim outputs
@@ -72,6 +96,14 @@ class Sim:
         SimOutput('Avg. Nat Freq',ExtendedDataType.TYPE_NATURAL_FREQUENCY,output_type='avg',when='ascent'),
         SimOutput('Avg. Char Len',ExtendedDataType.TYPE_CHAR_OSCILLATION_DISTANCE,output_type='avg',when='ascent'),
     ]
+    # standard deviations of the parameter variations applied by vary_parameters
+    perturbations = {
+        'mass' : 0.025, # fraction of each component's mass
+        'launchrod_ang' : 2, # deg
+        'launchrod_dir' : 5, # deg
+        'windspeed_avg' : 0.05, # fraction of the average windspeed
+        'windturb_int' : 0.05, # turbulence intensity
+    }
     def __init__(self, ORinstance, orh, ork_file, idx, name, motor):
         self.idx = idx
         self.name = name
@@ -83,65 +115,263 @@ class Sim:
         self.num_iters = 1
         self.events = []
         self.vary_params = True
+        self.num_workers = 1 # number of worker processes to spread iterations over, 1 runs in this process
+        self.streamed = False
+        self.keep_trajectories = 10 # number of full trajectories kept when streaming
+        self.sample_trajectories = False # when streaming, keep a random sample of trajectories instead of the first ones
+        self.kept = []
+        self.output_state = []
+        self.seed = None # seed for the random parameter variations, None for a different random run every time
+        self.perturbations = dict(Sim.perturbations)
+        self.cache = None # SimCache to load/store seeded runs, None to always run
+        self.fetch_all = False # extract every FlightDataType from each iteration, rather than only required_datatypes()
+        self.plot_datatypes = set() # data types shown in the plot panes, extracted along with the outputs' data types
+        self.result_dtype = np.float64 # dtype of the listener's results, np.float32 halves their memory
+        self.decimation = {} # decimation of each iteration's data, e.g. {'every':10}, see ORSimListener
+        self.profiler = None # Profiler to record the run's timings in, None to not profile
+        self.server = os.environ.get(SERVER_ENV) or None # address of a SimServer to run iterations on, None to run them here
+        self.jar_path = None # OpenRocket .jar for worker processes' JVMs, None for orhelper's default
     
-    def run(self, iterations = 1):
-        iterations = min(max(1,iterations),100)
+    def run(self, iterations = 1, workers = None, stream = None, progress = None, cancel = None):
+        ''' Run the simulation for a number of iterations, varying the parameters between iterations if vary_params is set.
+            If stream is True, output statistics are accumulated as each iteration finishes and only keep_trajectories
+            iterations' full data is kept (the first ones, or a uniform random sample if sample_trajectories is set), so
+            memory use doesn't grow with the number of iterations. Otherwise every iteration's data is kept and iterations
+            are limited to MAX_ITERATIONS. By default, runs of more than MAX_ITERATIONS iterations are streamed.
+            progress: optional function called as progress(iterations finished, iterations) after each iteration
+            cancel: optional threading.Event - once set, the run stops after the current iteration and keeps what has finished. '''
+        iterations = max(1,iterations)
+        if stream is None:
+            stream = iterations > MAX_ITERATIONS
+        if not stream:
+            iterations = min(iterations,MAX_ITERATIONS)
         self.num_iters = iterations
+        self.streamed = stream
+
+        cache_key = None
+        if self.cache is not None and self.seed is not None: # unseeded runs are meant to differ, never cache them
+            with self.phase('cache'):
+                cache_key = self.cache.key(self.ork_file, self.cache_settings())
+                cached = self.cache.load(cache_key)
+            if cached is not None:
+                print("Loaded " + str(iterations) + " simulation iterations from cache")
+                self.data, self.events, self.kept, self.output_state = cached
+                self.update_outputs()
+                return
+
         self.data = []
         self.events = []
-        self.doc = self.orh.load_doc(self.ork_file)
-
-        sim = self.doc.getSimulation(self.idx) 
-        opts = sim.getOptions()
-        rocket = opts.getRocket()
-        self.hold_parameters(opts,rocket)
-
-        for i in range(iterations):
-            print("Running simulation iteration " + str(i+1)+ " of " + str(iterations))
-
-            if iterations > 1 and self.vary_params:
-                self.vary_parameters(opts,rocket)
-
-            # Run simulation
-            orsimlistener = ORSimListener(sim, rocket)
-            self.orh.run_simulation(sim,listeners=[orsimlistener])
-            data = self.orh.get_timeseries(sim, [e for e in FlightDataType]) # get all data available
-            extended_data = orsimlistener.get_results()
-            data.update(extended_data)
-            events = self.orh.get_events(sim)
-            
-            # Add data to simulation list
+        self.kept = [] # iteration number of each entry in data
+        self.sample_rng = random.Random(self.seed)
+        self.clear_outputs()
+
+        runs = self.iterate(iterations, workers)
+        for i, (data, events) in enumerate(runs):
+            with self.phase('outputs'):
+                results = PaddedResults([data],[events]) # event indices found once and shared by all outputs
+                for output in self.outputs:
+                    output.push(output.evaluate(results)[0])
+            self.keep_iteration(i, data, events)
+            if progress is not None:
+                progress(i+1, iterations)
+            if cancel is not None and cancel.is_set() and i+1 < iterations:
+                print("Simulation cancelled after " + str(i+1) + " of " + str(iterations) + " iterations")
+                self.num_iters = i+1
+                cache_key = None # don't cache a partial run
+                break
+        runs.close() # if cancelled, stops the worker pool right away
+        self.output_state = [output.get_state() for output in self.outputs]
+        with self.phase('update_outputs'):
+            self.update_outputs()
+        if cache_key is not None:
+            with self.phase('cache'):
+                self.cache.store(cache_key, (self.data, self.events, self.kept, self.output_state))
+
+    def phase(self, name):
+        ''' Context manager timing a phase of the run if profiling, see Profiler. '''
+        return NO_PROFILER if self.profiler is None else self.profiler.phase(name)
+
+    def timed_iteration(self, i):
+        ''' Context manager timing iteration i, and the phases inside it, if profiling, see Profiler.iteration. '''
+        return NO_PROFILER if self.profiler is None else self.profiler.iteration(self.iteration_label(i))
+
+    def iteration_label(self, i):
+        ''' Name of iteration i in timing reports. '''
+        return self.name + ' iteration ' + str(i+1)
+
+    def cache_settings(self):
+        ''' Everything other than the .ork file that determines the results of run(). '''
+        return {'idx':self.idx, 'iterations':self.num_iters, 'seed':self.seed, 'vary_params':self.vary_params,
+                'perturbations':self.perturbations, 'streamed':self.streamed, 'keep_trajectories':self.keep_trajectories,
+                'sample_trajectories':self.sample_trajectories, 'result_dtype':np.dtype(self.result_dtype).name,
+                'decimation':self.decimation,
+                'datatypes':'all' if self.fetch_all else sorted(x.name for x in self.required_datatypes())}
+
+    def required_datatypes(self):
+        ''' The FlightDataTypes extracted from each iteration: time, those used by the outputs and those being plotted.
+            Other data types are fetched on demand from the iterations kept in this process, see SimResults.RunData. '''
+        required = {FlightDataType.TYPE_TIME}
+        required.update(output.datatype for output in self.outputs)
+        required.update(self.plot_datatypes)
+        required = metrics.base_inputs(required) # metrics are computed from their inputs, see metrics
+        return [x for x in FlightDataType if x in required] # ListenerDataTypes come from the listener
+
+    def iteration_seed(self, i):
+        ''' Seed for iteration i, derived from the run's seed so that results don't depend on which process ran it. '''
+        return None if self.seed is None else str(self.seed) + ':' + str(i)
+
+    def iterate(self, iterations, workers = None):
+        ''' Generator running the iterations of the simulation, yielding each iteration's (data, events) in order. '''
+        if workers is None:
+            workers = self.num_workers
+        vary = iterations > 1 and self.vary_params
+
+        if self.server is not None or (workers > 1 and iterations > 1):
+            # Run iterations in parallel, each worker process has its own JVM and copy of the document
+            jobs = ({'ork_file':os.path.abspath(self.ork_file), 'idx':self.idx, 'vary':vary, 'seed':self.iteration_seed(i),
+                     'perturbations':self.perturbations, 'datatypes':self.required_datatypes(), 'dtype':self.result_dtype,
+                     'decimation':self.decimation, 'profile':self.profiler is not None, 'fetch_all':self.fetch_all}
+                    for i in range(iterations))
+            with self.phase('start_pool'):
+                # a server's workers are already running, with their JVMs warm
+                pool = SimClient(self.server) if self.server is not None else SimPool(min(workers,iterations), jar_path=self.jar_path)
+            with pool:
+                for i, result in enumerate(pool.imap(jobs)):
+                    print("Finished simulation iteration " + str(i+1)+ " of " + str(iterations))
+                    if self.profiler is not None: # the worker's timings come along with its results
+                        self.profiler.merge(result[2], label=self.iteration_label(i))
+                        result = result[:2]
+                    yield result
+        else:
+            with self.phase('load'):
+                self.load()
+            for i in range(iterations):
+                print("Running simulation iteration " + str(i+1)+ " of " + str(iterations))
+                with self.timed_iteration(i):
+                    result = self.run_iteration(vary, self.iteration_seed(i))
+                yield result
+
+    def keep_iteration(self, i, data, events):
+        ''' Add iteration i's data to the simulation list, if it is one of the trajectories being kept. '''
+        if not self.streamed or len(self.data) < self.keep_trajectories:
             self.data.append(data)           
             self.events.append(events)
-        self.update_outputs()
+            self.kept.append(i)
+        elif self.sample_trajectories:
+            j = self.sample_rng.randrange(i+1) # reservoir sampling, every iteration is equally likely to be kept
+            if j < self.keep_trajectories:
+                self.data[j] = data
+                self.events[j] = events
+                self.kept[j] = i
+
+    def load(self):
+        ''' Get a fresh copy of this simulation from the (cached) ORK document and hold its nominal parameters. '''
+        self.doc = orhh.load_doc(self.orh, self.ork_file)
+        self.or_sim = orhh.get_isolated_simulation(self.doc, self.idx) # vary_parameters mustn't touch the cached doc
+        self.opts = self.or_sim.getOptions()
+        self.rocket = self.or_sim.getRocket()
+        self.hold_parameters(self.opts,self.rocket)
+
+    def run_iteration(self, vary = False, seed = None):
+        ''' Run a single iteration of the loaded simulation, returning its (data, events). 
+            If vary is True, the simulation parameters are perturbed before running.
+            If seed is given, the parameter variations and OpenRocket's own randomness are seeded with it. '''
+        rng = random.Random(seed)
+        if vary:
+            with self.phase('vary_parameters'):
+                self.vary_parameters(self.opts,self.rocket,rng)
+
+        # Run simulation
+        orsimlistener = ORSimListener(self.or_sim, self.rocket, self.result_dtype, **self.decimation, timed=self.profiler is not None)
+        or_seed = None if seed is None else rng.randrange(2**31) # OpenRocket takes a java int seed
+        with self.phase('run_simulation'): # includes the listener's steps, which are also reported on their own
+            orhh.run_simulation(self.orh,self.or_sim,listeners=[orsimlistener],seed=or_seed)
+        if self.profiler is not None:
+            self.profiler.add_steps(orsimlistener.step_times)
+        with self.phase('transfer'):
+            data, events = self.transfer_results(orsimlistener)
+        return data, events
+
+    def transfer_results(self, orsimlistener):
+        ''' Extract the (data, events) of the iteration that just ran from OpenRocket and the listener. '''
+        branch = self.or_sim.getSimulatedData().getBranch(0)
+        datatypes = list(FlightDataType) if self.fetch_all else self.required_datatypes()
+        data = orhh.get_branch_data(self.orh, branch, datatypes)
+        fetch = self.fetch_datatype
+        if orsimlistener.decimated(): # keep only the branch rows of the steps the listener kept
+            rows = orsimlistener.get_rows(data[FlightDataType.TYPE_TIME])
+            data = {datatype:np.asarray(values)[rows] for datatype, values in data.items()}
+            fetch = lambda branch, datatype: np.asarray(self.fetch_datatype(branch, datatype))[rows]
+        data = RunData(data, branch, fetch)
+        extended_data = orsimlistener.get_results()
+        data.update(extended_data)
+        events = self.orh.get_events(self.or_sim)
+        return data, events
     
+    def fetch_datatype(self, branch, datatype):
+        return orhh.get_branch_data(self.orh, branch, [datatype])[datatype]
+
     def update_outputs(self):
-        for output in self.outputs:
-            output.update(self.data,self.events)
+        if self.streamed: # not all iterations were kept, restore the statistics accumulated during the run
+            for output, state in zip(self.outputs,self.output_state):
+                output.set_state(state)
+        else:
+            results = PaddedResults(self.data,self.events)
+            for output in self.outputs:
+                output.update(results)
+
+    def aligned(self, datatypes = None, num_samples = 500, align = None):
+        ''' Returns the kept iterations resampled onto a shared time grid as 2-D arrays, see SimResults.AlignedResults. '''
+        return AlignedResults(self.data, self.events, datatypes, num_samples, align)
 
     def hold_parameters(self,opts,rocket):
         self.launchrod_dir = np.rad2deg(opts.getLaunchRodDirection())
         self.launchrod_ang = np.rad2deg(opts.getLaunchRodAngle())
         self.windspeed_avg = opts.getWindSpeedAverage()
         self.windturb_int = opts.getWindTurbulenceIntensity()
-        self.comps = [x for x in orhh.get_all_components(rocket) if bool(x.isMassive())] # dont include items that don't have a mass, ruins everything
+        self.comps = list(orhh.get_component_index(rocket).massive) # dont include items that don't have a mass, ruins everything
         self.masses = [float(x.getMass()) for x in self.comps]
+        self.mass_overridden = [bool(x.isMassOverridden()) for x in self.comps]
+        self.nominal_conditions = {'launchrod_ang':self.launchrod_ang, 'launchrod_dir':self.launchrod_dir,
+                                   'windspeed_avg':self.windspeed_avg, 'windturb_int':self.windturb_int}
+
+    def set_parameters(self,params):
+        ''' Set launch conditions to fixed values, e.g. for a parameter sweep. params maps any of 'launchrod_ang',
+            'launchrod_dir' (deg), 'windspeed_avg' (m/s) and 'windturb_int' to a value - the rest, and all component
+            masses, are reset to their nominal values. vary_parameters then varies around these values. '''
+        for key in params:
+            if key not in self.nominal_conditions:
+                raise KeyError("Unknown launch condition " + str(key) + ", expected one of " + ', '.join(self.nominal_conditions))
+        values = dict(self.nominal_conditions)
+        values.update(params)
+        self.launchrod_ang = values['launchrod_ang']
+        self.launchrod_dir = values['launchrod_dir']
+        self.windspeed_avg = values['windspeed_avg']
+        self.windturb_int = values['windturb_int']
+        for component, mass, overridden in zip(self.comps,self.masses,self.mass_overridden):
+            component.setOverrideMass(mass)
+            component.setMassOverridden(overridden)
+        self.opts.setLaunchRodAngle(np.deg2rad(self.launchrod_ang))
+        self.opts.setLaunchRodDirection(np.deg2rad(self.launchrod_dir))
+        self.opts.setWindSpeedAverage(self.windspeed_avg)
+        self.opts.setWindTurbulenceIntensity(self.windturb_int)
     
-    def vary_parameters(self,opts,rocket):
+    def vary_parameters(self,opts,rocket,rng=random):
         ''' Vary the simulation parameters using normal distributions to introduce noise into the system. 
-            Aids in determining a more realistic standard deviation for altitude with many simulation runs. '''
+            Aids in determining a more realistic standard deviation for altitude with many simulation runs.
+            Standard deviations are taken from self.perturbations, rng is the random number generator to draw from. '''
         for i in range(len(self.comps)):
             component = self.comps[i]
-            new_m = self.masses[i]*gauss(1.0,0.025) # mass of components taken to be +/- 2.5%
+            new_m = self.masses[i]*rng.gauss(1.0,self.perturbations['mass']) # mass of components taken to be +/- 2.5%
             try:
                 component.setMassOverridden(True)
                 component.setOverrideMass(new_m) # vary mass of components with +/- 5 percent standard dev
             except Exception as e:
                 print(e)
-        opts.setLaunchRodAngle(np.deg2rad(gauss(self.launchrod_ang,2))) # vary launch rod angle +/- 2deg
-        opts.setLaunchRodDirection(np.deg2rad(gauss(self.launchrod_dir,5))) # vary launch rod direction +/- 5deg
-        opts.setWindSpeedAverage(max(0,self.windspeed_avg*gauss(1.0,0.05))) # vary average windspeed +/- 5% 
-        opts.setWindTurbulenceIntensity(max(0,gauss(self.windturb_int,0.05))) # vary turbulence intensity +/- 5%
+        opts.setLaunchRodAngle(np.deg2rad(rng.gauss(self.launchrod_ang,self.perturbations['launchrod_ang']))) # vary launch rod angle +/- 2deg
+        opts.setLaunchRodDirection(np.deg2rad(rng.gauss(self.launchrod_dir,self.perturbations['launchrod_dir']))) # vary launch rod direction +/- 5deg
+        opts.setWindSpeedAverage(max(0,self.windspeed_avg*rng.gauss(1.0,self.perturbations['windspeed_avg']))) # vary average windspeed +/- 5% 
+        opts.setWindTurbulenceIntensity(max(0,rng.gauss(self.windturb_int,self.perturbations['windturb_int']))) # vary turbulence intensity +/- 5%
 
     @staticmethod
     def clear_outputs():
@@ -0,0 +1,87 @@
+'''
+SimCache:
+
+A content-addressed, on-disk cache of simulation results. Entries are keyed by a hash of the .ork file's bytes and the
+settings that determine a run's results (simulation index, iterations, perturbations, seed, ...), so re-running an
+unchanged, seeded simulation loads its results from disk instead of running OpenRocket again.
+
+The cache is limited to max_bytes on disk, evicting the least recently used entries first.
+'''
+
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+class SimCache:
+    def __init__(self, directory='.simcache', max_bytes=2*1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._file_hashes = {} # path -> (mtime, size, sha256 of contents), so unchanged files aren't re-read
+
+    def hash_file(self, path):
+        ''' Returns the sha256 hex digest of a file's contents. '''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        hit = self._file_hashes.get(path)
+        if hit is None or hit[:2] != (stat.st_mtime, stat.st_size):
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+            hit = (stat.st_mtime, stat.st_size, sha.hexdigest())
+            self._file_hashes[path] = hit
+        return hit[2]
+
+    def key(self, ork_file, settings):
+        ''' Returns the cache key for running ork_file with settings, a JSON-serializable dict of everything else
+            that affects the results. '''
+        sha = hashlib.sha256(self.hash_file(ork_file).encode())
+        sha.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def load(self, key):
+        ''' Returns the cached value for key, or None if it isn't cached. '''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path) # mark as recently used
+        return value
+
+    def store(self, key, value):
+        ''' Cache value under key, then evict old entries if the cache has grown past max_bytes. '''
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path(key)) # atomic, readers never see a partially written entry
+        self.evict()
+
+    def evict(self):
+        ''' Delete least recently used entries until the cache fits in max_bytes. '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        ''' Delete every entry in the cache. '''
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.directory, name))
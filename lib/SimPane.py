@@ -1,3 +1,4 @@
+import time
 import tkinter as tk
 from tkinter import ttk
 import numpy as np
@@ -5,6 +6,12 @@ from lib import orhelperhelper as orhh
 import orhelper
 from .units import units
 from .Sim import Sim
+from .SimCache import SimCache
+from .SimRunner import SimRunner
+from .Profiler import Profiler
+
+POLL_MS = 100 # how often to check on a run in progress, ms
+PLOT_INTERVAL = 2.0 # minimum time between plot updates during a run, s
 
 class SimPane(ttk.Frame):
     def __init__(self, root, plotpane, freeplotpane):
@@ -45,7 +52,16 @@ class SimPane(ttk.Frame):
         ttk.Label(self,text='Num. iterations').grid(row = i+3, column=0,sticky='nsew')
         self.iter_var = tk.IntVar(self,value=1)
         ttk.Entry(self,textvariable=self.iter_var).grid(row=i+3, column=1,columnspan=3, sticky='nsew')
-        ttk.Button(self,text='Run Sim',command=self.run_sim).grid(row=i+3, column=4, sticky='nsew')
+        self.run_button = ttk.Button(self,text='Run Sim',command=self.run_sim)
+        self.run_button.grid(row=i+3, column=4, sticky='nsew')
+        ttk.Label(self,text='Num. workers').grid(row = i+4, column=0,sticky='nsew')
+        self.workers_var = tk.IntVar(self,value=1)
+        ttk.Entry(self,textvariable=self.workers_var).grid(row=i+4, column=1,columnspan=3, sticky='nsew')
+        ttk.Label(self,text='Seed').grid(row = i+5, column=0,sticky='nsew')
+        self.seed_var = tk.StringVar(self,value='') # blank for a new random run every time, seeded runs are cached
+        ttk.Entry(self,textvariable=self.seed_var).grid(row=i+5, column=1,columnspan=3, sticky='nsew')
+        self.profile_var = tk.BooleanVar(self,value=False) # print a timing report to the console after each run
+        ttk.Checkbutton(self,text='Profile run',variable=self.profile_var).grid(row=i+6, column=0,columnspan=2, sticky='nsew')
 
         self.columnconfigure(1,weight=1)
         self.columnconfigure(3,weight=1)
@@ -54,6 +70,9 @@ class SimPane(ttk.Frame):
         self.sim_names = []
         self.sims = []
         self.curr_sim = None
+        self.cache = SimCache()
+        self.runner = None # SimRunner of the run in progress
+        self.last_plot = 0 # time of the last plot update during a run
     
     def clear_sims(self):
         self.sims = []
@@ -64,19 +83,30 @@ class SimPane(ttk.Frame):
 
     def add_sim(self, sim_name, sim_motor):
         sim_idx = len(self.sims)
-        self.sims.append(Sim(self.instance, self.orh, self.ork_file, sim_idx, sim_name,sim_motor))
+        sim = Sim(self.instance, self.orh, self.ork_file, sim_idx, sim_name,sim_motor)
+        sim.cache = self.cache
+        self.sims.append(sim)
         self.sim_names.append(sim_name + ' - ' + sim_motor)
 
+    def running(self):
+        return self.runner is not None and self.runner.is_alive()
+
     def change_sim(self, *args):
         # check which sim name is selected
         sim_selected = self.sim_names.index(self.sim_select_var.get())
         if sim_selected == -1:
             return
+        if self.running(): # outputs are shared between sims, so the sim can't change mid-run
+            if self.sims[sim_selected] is not self.curr_sim:
+                print("Wait for the current run to finish, or cancel it, before changing sims.")
+                self.sim_select_var.set(self.sim_names[self.sims.index(self.curr_sim)])
+            return
         self.curr_sim = self.sims[sim_selected] # get Sim object
         # update output variables, binding change of Sim vars to updating label vars
         self.curr_sim.clear_outputs()
         # clear plots, update plotting if data exists
         if len(self.curr_sim.data) > 0:
+            self.curr_sim.update_outputs() # outputs are shared between sims, recompute them for this one
             self.plot()
             self.update_outputs()
         #update free plot pane with sim
@@ -87,23 +117,29 @@ class SimPane(ttk.Frame):
         for i in range(len(Sim.outputs)):
             self.update_output(i)
         
-    def update_output(self,idx):
+    def update_output(self,idx,mean=None,stddev=None):
+        ''' Update an output's labels, from the given mean and stddev or else the output's current values. '''
+        if mean is None:
+            mean, stddev = Sim.outputs[idx].mean, Sim.outputs[idx].stddev
         newunit = self.outunits[idx].get()
         baseunit = Sim.outputs[idx].unit
         precision = 2 # rounding precision
-        self.outmeans[idx].set(round(units.convert(Sim.outputs[idx].mean, baseunit, newunit),precision))
-        self.outstds[idx].set(round(units.convert(Sim.outputs[idx].stddev, baseunit, newunit),precision))
+        self.outmeans[idx].set(round(units.convert(mean, baseunit, newunit),precision))
+        self.outstds[idx].set(round(units.convert(stddev, baseunit, newunit),precision))
 
     def giveORinstance(self,instance):
         self.instance = instance
         self.orh = orhelper.Helper(instance)
 
     def updateFromORK(self, ORKfile):
+        if self.running():
+            print("Wait for the current run to finish, or cancel it, before loading an ORK file.")
+            return
         self.clear_sims()
         # Get new simulation names
         self.ork_file = ORKfile
 
-        doc = self.orh.load_doc(ORKfile)
+        doc = orhh.load_doc(self.orh, ORKfile)
         sims = orhh.get_simulations(doc)
         for key in sims:
             self.add_sim(key, sims[key])
@@ -118,11 +154,49 @@ class SimPane(ttk.Frame):
             self.sim_select_var.set(self.sim_names[0])
     
     def run_sim(self,event=None):
+        ''' Start running the current sim in the background, or cancel the run if one is in progress. '''
+        if self.running():
+            self.runner.cancel()
+            self.run_button.configure(text='Cancelling...',state=tk.DISABLED)
+            return
         if self.curr_sim is None:
             return
-        self.curr_sim.run(int(self.iter_var.get()))
-        self.update_outputs()
-        self.plot()
+        seed = self.seed_var.get().strip()
+        self.curr_sim.seed = seed if seed != '' else None
+        self.curr_sim.plot_datatypes = set(self.plotpane.get_datatypes()) | set(self.freeplotpane.get_datatypes())
+        self.curr_sim.profiler = Profiler() if self.profile_var.get() else None
+        self.runner = SimRunner(self.curr_sim,int(self.iter_var.get()),workers=int(self.workers_var.get()))
+        self.runner.start()
+        self.run_button.configure(text='Cancel')
+        self.after(POLL_MS,self.poll_runner)
+
+    def poll_runner(self):
+        ''' Handle messages from the background run, updating outputs and plots as iterations finish. '''
+        stats = None
+        finished = False
+        for message in self.runner.messages():
+            if message[0] == 'progress':
+                stats = message[3]
+            elif message[0] == 'error':
+                print("Simulation failed: " + repr(message[1]))
+                finished = True
+            else:
+                finished = True
+        if finished:
+            self.run_button.configure(text='Run Sim',state=tk.NORMAL)
+            if self.curr_sim.profiler is not None:
+                print(self.curr_sim.profiler.summary())
+            self.update_outputs()
+            if len(self.curr_sim.data) > 0:
+                self.plot()
+            return
+        if stats is not None:
+            for i in range(len(stats)):
+                self.update_output(i,*stats[i])
+            if time.monotonic() - self.last_plot > PLOT_INTERVAL and len(self.curr_sim.data) > 0:
+                self.plot()
+                self.last_plot = time.monotonic()
+        self.after(POLL_MS,self.poll_runner)
     
     def plot(self):
         self.freeplotpane.update_all()
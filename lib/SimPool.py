@@ -0,0 +1,123 @@
+'''
+SimPool:
+
+A pool of worker processes for running Monte Carlo iterations of a Sim in parallel. Each worker boots its own
+OpenRocket JVM and loads its own copy of the .ork document, so iterations run independently on separate cores.
+
+Work is handed out as job dicts (see run_job) and results come back in submission order as the same (data, events)
+pairs that Sim.run builds when running serially, so update_outputs and the plot panes don't know the difference.
+'''
+
+import os
+import numpy as np
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+import orhelper
+from .SimResults import PaddedResults
+from .Profiler import Profiler
+
+_worker_instance = None # OpenRocketInstance owned by this worker process
+_worker_sims = {} # (modification time, Sim) loaded in this worker process, keyed by (ork_file, sim index)
+
+def init_worker(preload=(), jar_path=None):
+    ''' Pool initializer - starts this worker's JVM. It is shut down when the worker process exits.
+        preload: .ork files to load into the worker right away, rather than when its first job needs them
+        jar_path: OpenRocket .jar to start the JVM with, None for orhelper's default '''
+    global _worker_instance
+    _worker_instance = orhelper.OpenRocketInstance(jar_path) if jar_path is not None else orhelper.OpenRocketInstance()
+    _worker_instance.__enter__()
+    Finalize(None, _worker_instance.__exit__, args=(None, None, None), exitpriority=10)
+    from . import orhelperhelper as orhh
+    for ork_file in preload:
+        orhh.load_doc(orhelper.Helper(_worker_instance), ork_file)
+
+def get_worker_sim(ork_file, idx):
+    ''' Returns the Sim for (ork_file, idx) in this worker, loading it the first time it is asked for or if the file has changed. '''
+    from .Sim import Sim # imported here to avoid a circular import, Sim imports this module
+    key = (ork_file, idx)
+    mtime = os.path.getmtime(ork_file)
+    if key not in _worker_sims or _worker_sims[key][0] != mtime:
+        sim = Sim(_worker_instance, orhelper.Helper(_worker_instance), ork_file, idx, '', '')
+        sim.load()
+        _worker_sims[key] = (mtime, sim)
+    return _worker_sims[key][1]
+
+def run_job(job):
+    ''' Runs a single simulation iteration described by a job dict and returns its (data, events), or if job['summary']
+        is set, just the value of each of Sim.outputs as a dict of output name to value.
+        job keys:
+            ork_file: path to the .ork file
+            idx: index of the simulation in the document
+            vary: if True, perturb the simulation parameters before running (see Sim.vary_parameters)
+            seed: seed for this iteration's randomness, or None
+            perturbations: standard deviations of the parameter variations, see Sim.perturbations
+            datatypes: the FlightDataTypes to extract, see Sim.required_datatypes
+            fetch_all: optional, if True extract every FlightDataType instead, see Sim.fetch_all
+            dtype: optional numpy dtype of the listener's results, see Sim.result_dtype
+            decimation: optional decimation of the iteration's data, see Sim.decimation
+            profile: optional, if True also return the iteration's timings, as (data, events, Profiler.get_state())
+            params: optional launch conditions to set before running, see Sim.set_parameters. Conditions that aren't
+                    given, and all component masses, are reset to the document's nominal values for every job.
+            summary: optional, if True return only the outputs' values instead of the full data
+    '''
+    sim = get_worker_sim(job['ork_file'], job['idx'])
+    sim.perturbations = job['perturbations']
+    sim.plot_datatypes = set(job['datatypes'])
+    sim.fetch_all = job.get('fetch_all', False)
+    sim.result_dtype = job.get('dtype', np.float64)
+    sim.decimation = job.get('decimation', {})
+    sim.profiler = Profiler() if job.get('profile') else None
+    # The worker's Sim outlives its jobs: put back the nominal launch conditions and masses from the .ork, so earlier
+    # jobs' variations and parameter settings don't carry over, then apply this job's launch conditions, if any
+    sim.set_parameters(job.get('params') or {})
+    with sim.timed_iteration(0): # labelled with its iteration number where the results are merged, see Sim.iterate
+        data, events = sim.run_iteration(vary=job['vary'], seed=job['seed'])
+    if job.get('summary'):
+        results = PaddedResults([data],[events])
+        return {output.name: float(output.evaluate(results)[0]) for output in sim.outputs}
+    if sim.profiler is not None:
+        return data, events, sim.profiler.get_state()
+    return data, events
+
+def list_simulations(ork_file):
+    ''' Returns the simulations of ork_file as orhelperhelper.get_simulations does, loaded in this worker. '''
+    from . import orhelperhelper as orhh
+    return orhh.get_simulations(orhh.load_doc(orhelper.Helper(_worker_instance), ork_file))
+
+class SimPool:
+    def __init__(self, workers=None, preload=(), jar_path=None):
+        ''' Starts a pool of workers processes, each owning an OpenRocket JVM. workers defaults to the number of CPUs.
+            preload: .ork files each worker loads as soon as it starts, see init_worker
+            jar_path: OpenRocket .jar the workers' JVMs run, None for orhelper's default '''
+        self.workers = max(1, workers or os.cpu_count())
+        # spawn, not fork - a forked child can't start a JVM of its own if the parent already has one running
+        self.pool = mp.get_context('spawn').Pool(self.workers, initializer=init_worker, initargs=(list(preload), jar_path))
+
+    def imap(self, jobs):
+        ''' Runs jobs across the pool, returning an iterator over their results in the order the jobs were given. '''
+        return self.pool.imap(run_job, jobs)
+
+    def submit(self, job):
+        ''' Queues one job, returning a multiprocessing AsyncResult for its result. '''
+        return self.pool.apply_async(run_job, (job,))
+
+    def simulations(self, ork_file):
+        ''' Returns the simulations of ork_file, a dict of simulation name to motor, from one of the workers. '''
+        return self.pool.apply(list_simulations, (ork_file,))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex, value, tb):
+        if ex is None:
+            self.close()
+        else:
+            self.terminate()
@@ -0,0 +1,182 @@
+'''
+SimResults:
+
+Containers holding a Sim's Monte Carlo iterations as 2-D numpy arrays with one row per iteration, so that envelopes,
+percentiles and other statistics across iterations are single vectorized operations instead of loops over the
+per-iteration data dicts in Sim.data.
+'''
+
+import warnings
+import numpy as np
+from orhelper import FlightDataType
+from . import metrics
+from .orhelperhelper import DataTypeMap
+from .units import UnitArray
+
+def _nanreduce(func, values, **kwargs):
+    ''' Apply a numpy nan-function, quietly returning NaN for columns that are all NaN. '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(values, **kwargs)
+
+class RunData(dict):
+    ''' One iteration's data, a dict mapping data types to arrays. Derived metrics (see metrics) are computed from
+        their inputs, and FlightDataTypes that weren't extracted when the iteration ran are fetched from its flight data
+        branch, the first time they're looked up, and kept from then on.
+        branch: the iteration's Java FlightDataBranch, or None if it isn't available (e.g. the iteration ran in another process)
+        fetch: function (branch, datatype) -> array that extracts a data type from the branch
+    '''
+    def __init__(self, data=(), branch=None, fetch=None):
+        super().__init__(data)
+        self.branch = branch
+        self.fetch = fetch
+        self.unit_arrays = {} # data type -> UnitArray of its values, see in_unit
+
+    def __missing__(self, datatype):
+        if metrics.is_metric(datatype):
+            self[datatype] = metrics.registry[datatype].evaluate(self)
+            return self[datatype]
+        if self.branch is None or self.fetch is None or not isinstance(datatype, FlightDataType):
+            raise KeyError(datatype)
+        self[datatype] = self.fetch(self.branch, datatype)
+        return self[datatype]
+
+    def in_unit(self, datatype, unit):
+        ''' Returns datatype's array converted from its DataTypeMap unit to unit. Conversions are kept, so plots can
+            switch units back and forth without converting the data again (see units.UnitArray). '''
+        if datatype not in self.unit_arrays:
+            self.unit_arrays[datatype] = UnitArray(self[datatype], DataTypeMap[datatype].unit)
+        return self.unit_arrays[datatype].to(unit)
+
+    def __reduce__(self):
+        return (RunData, (dict(self),)) # the Java branch can't leave this process, pickle only what was extracted
+
+class AlignedResults:
+    def __init__(self, data, events, datatypes=None, num_samples=500, align=None, t_max=None):
+        ''' Resample each iteration onto a shared time grid, storing each data type as an (iterations x samples) array.
+            data, events: per-iteration lists of data and events, as in Sim.data and Sim.events
+            datatypes: the data types to store, defaults to every type in the first iteration
+            num_samples: number of points in the shared grid
+            align: a FlightEvent to normalize time by, e.g. FlightEvent.APOGEE puts every iteration's apogee at 1.0.
+                   If None, the grid is time since launch in seconds.
+            t_max: end of the grid, defaults to the end of the longest iteration (normalized if align is set)
+            Grid points outside an iteration's time span, or all of them if the iteration never hit the align event, are NaN.
+        '''
+        self.num_iters = len(data)
+        self.align = align
+        if datatypes is None:
+            datatypes = list(data[0].keys()) if self.num_iters > 0 else []
+
+        # event times of every iteration, NaN where an iteration didn't have the event
+        self.event_times = {}
+        for i in range(self.num_iters):
+            for event, times in events[i].items():
+                if event not in self.event_times:
+                    self.event_times[event] = np.full(self.num_iters, np.nan)
+                self.event_times[event][i] = times[0]
+
+        times = []
+        for i in range(self.num_iters):
+            t = np.asarray(data[i][FlightDataType.TYPE_TIME], dtype=float)
+            if align is not None:
+                t_event = self.event_times.get(align, np.full(self.num_iters, np.nan))[i]
+                t = t/t_event if t_event > 0 else None # can't align an iteration that never reached the event
+            times.append(t)
+
+        if t_max is None:
+            t_ends = [t[-1] for t in times if t is not None and len(t) > 0]
+            t_max = max(t_ends) if t_ends else 0.0
+        self.grid = np.linspace(0.0, t_max, num_samples)
+
+        self.columns = {}
+        for datatype in datatypes:
+            column = np.full((self.num_iters, num_samples), np.nan)
+            for i in range(self.num_iters):
+                if times[i] is not None and len(times[i]) > 0:
+                    column[i] = np.interp(self.grid, times[i], np.asarray(data[i][datatype], dtype=float), left=np.nan, right=np.nan)
+            self.columns[datatype] = column
+
+    def __getitem__(self, datatype):
+        ''' Returns the (iterations x samples) array for datatype. '''
+        return self.columns[datatype]
+
+    def __contains__(self, datatype):
+        return datatype in self.columns
+
+    def mean(self, datatype):
+        ''' Mean across iterations at each grid point. '''
+        return _nanreduce(np.nanmean, self.columns[datatype], axis=0)
+
+    def std(self, datatype):
+        ''' Standard deviation across iterations at each grid point. '''
+        return _nanreduce(np.nanstd, self.columns[datatype], axis=0)
+
+    def percentile(self, datatype, q):
+        ''' q-th percentile(s) across iterations at each grid point, q can be a sequence, e.g. [5, 50, 95]. '''
+        return _nanreduce(np.nanpercentile, self.columns[datatype], q=q, axis=0)
+
+    def envelope(self, datatype):
+        ''' Returns (min, max) across iterations at each grid point. '''
+        column = self.columns[datatype]
+        return _nanreduce(np.nanmin, column, axis=0), _nanreduce(np.nanmax, column, axis=0)
+
+class PaddedResults:
+    def __init__(self, data, events):
+        ''' Holds iterations' raw (not resampled) data as NaN-padded (iterations x longest iteration) arrays.
+            Data types are stacked the first time they're asked for, and event indices and masks are computed once
+            for all iterations and shared by everything that uses them.
+            data, events: per-iteration lists of data and events, as in Sim.data and Sim.events
+        '''
+        self.data = data
+        self.events = events
+        self.num_iters = len(data)
+        self.lengths = np.array([len(d[FlightDataType.TYPE_TIME]) for d in data], dtype=int)
+        self.width = int(self.lengths.max()) if self.num_iters > 0 else 0
+        self.columns = {}
+        self._event_times = {}
+        self._event_indices = {}
+        self._before = {}
+        self.time = self[FlightDataType.TYPE_TIME]
+
+    def __getitem__(self, datatype):
+        ''' Returns the NaN-padded (iterations x samples) array for datatype. '''
+        if datatype not in self.columns:
+            rows = [np.asarray(d[datatype], dtype=float) for d in self.data]
+            lengths = np.array([len(row) for row in rows], dtype=int)
+            column = np.full((self.num_iters, self.width), np.nan)
+            if self.num_iters > 0:
+                column[np.arange(self.width) < lengths[:,None]] = np.concatenate(rows) # fill every row in one assignment
+            self.columns[datatype] = column
+        return self.columns[datatype]
+
+    def event_times(self, event):
+        ''' Time of the first occurrence of event in each iteration, NaN where it didn't occur. '''
+        if event not in self._event_times:
+            self._event_times[event] = np.array([e[event][0] if event in e else np.nan for e in self.events], dtype=float)
+        return self._event_times[event]
+
+    def event_index(self, event):
+        ''' Index of the first sample at or after event in each iteration. Iterations where the event didn't occur,
+            or occurred after the last sample, get their last sample. '''
+        if event not in self._event_indices:
+            t_event = self.event_times(event)
+            idx = np.sum(self.time < t_event[:,None], axis=1) # NaN padding never compares less, so this is a per-row searchsorted
+            self._event_indices[event] = np.where(np.isnan(t_event) | (idx >= self.lengths), self.lengths-1, idx)
+        return self._event_indices[event]
+
+    def before(self, event):
+        ''' Boolean (iterations x samples) mask of the samples before event, all False where it didn't occur. '''
+        if event not in self._before:
+            self._before[event] = self.time < self.event_times(event)[:,None]
+        return self._before[event]
+
+    def at(self, datatype, event):
+        ''' Value of datatype at event for each iteration, see event_index. '''
+        return np.take_along_axis(self[datatype], self.event_index(event)[:,None], axis=1)[:,0]
+
+    def reduce(self, func, datatype, mask=None):
+        ''' Apply a numpy nan-function (e.g. np.nanmax) to each iteration's datatype, over the samples in mask if given. '''
+        values = self[datatype]
+        if mask is not None:
+            values = np.where(mask, values, np.nan)
+        return _nanreduce(func, values, axis=1)
@@ -0,0 +1,48 @@
+'''
+SimRunner:
+
+Runs a Sim on a background thread so that the GUI stays responsive during long Monte Carlo runs. Progress is sent
+back to the GUI thread through a thread-safe queue, which the GUI polls (tkinter isn't thread-safe, so the background
+thread never touches widgets itself). Messages on the queue are tuples:
+
+    ('progress', iterations finished, iterations, stats)  after each iteration, stats being [(mean, stddev), ...]
+                                                          of each of Sim.outputs so far
+    ('done', cancelled)                                   when the run has finished, or stopped after being cancelled
+    ('error', exception)                                  if the run failed
+'''
+
+import queue
+import threading
+
+class SimRunner(threading.Thread):
+    def __init__(self, sim, iterations, workers=None):
+        super().__init__(daemon=True)
+        self.sim = sim
+        self.iterations = iterations
+        self.workers = workers
+        self.queue = queue.Queue()
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        try:
+            self.sim.run(self.iterations, workers=self.workers, progress=self.report, cancel=self.cancel_event)
+            self.queue.put(('done', self.cancel_event.is_set()))
+        except Exception as e:
+            self.queue.put(('error', e))
+
+    def report(self, finished, iterations):
+        stats = [(output.mean, output.stddev) for output in self.sim.outputs]
+        self.queue.put(('progress', finished, iterations, stats))
+
+    def cancel(self):
+        ''' Stop the run after the iteration currently running. '''
+        self.cancel_event.set()
+
+    def messages(self):
+        ''' Returns all messages currently waiting on the queue, without blocking. '''
+        messages = []
+        while True:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                return messages
@@ -0,0 +1,197 @@
+'''
+SimServer:
+
+A long-lived local simulation service. The server keeps a SimPool of warm OpenRocket JVMs (optionally with documents
+preloaded) and runs jobs sent to it over a local socket, so GUI sessions and scripts can run simulations without
+booting Java themselves. SimClient has the same interface as SimPool, so anything that runs jobs on a pool can run them
+on a server instead.
+
+Start a server with the CLI:
+    python ORKPlusCLI.py serve --workers 8 --preload OlympusTestRocket-Current.ork
+then point runs at it, with --server localhost:6789 on the CLI, or by setting ORKPLUS_SERVER=localhost:6789 for the GUI.
+Clients authenticate with the shared key in ORKPLUS_AUTHKEY. If it isn't set when the server starts, the server makes up a
+random key and prints it - set ORKPLUS_AUTHKEY to it for the clients. Messages are pickles, so anyone holding the key can
+run code as the server's user: keep the key private.
+
+Messages are pickled tuples over a multiprocessing.connection:
+    client -> server: ('imap', [job, ...])      run jobs (see SimPool.run_job), the server replies with a
+                                                ('result', result) for each in order, then ('done',)
+                      ('cancel',)               stop running the jobs of the current imap, sent while receiving
+                                                its results. The server replies ('done',) once the jobs already
+                                                running have finished.
+                      ('simulations', ork_file) the server replies ('result', {simulation name: motor}), see SimPool.simulations
+                      ('ping',)                 the server replies ('pong', number of workers)
+                      ('shutdown',)             stop the server
+    server -> client: ('error', exception)      a job failed, no more results follow for that request
+'''
+
+import os
+import secrets
+import collections
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from .SimPool import SimPool
+
+DEFAULT_ADDRESS = ('localhost', 6789)
+SERVER_ENV = 'ORKPLUS_SERVER' # environment variable with the address of a server for Sims to use, e.g. localhost:6789
+AUTHKEY_ENV = 'ORKPLUS_AUTHKEY' # environment variable with the shared key clients authenticate to the server with
+
+def get_authkey():
+    ''' Returns the shared key from ORKPLUS_AUTHKEY. Raises a ValueError if it isn't set. '''
+    key = os.environ.get(AUTHKEY_ENV)
+    if not key:
+        raise ValueError("Set " + AUTHKEY_ENV + " to the simulation server's key to connect to it")
+    return key.encode()
+
+def parse_address(address):
+    ''' Parse 'host:port' (or just 'port') into a (host, port) address. '''
+    if isinstance(address, tuple):
+        return address
+    host, _, port = str(address).rpartition(':')
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+class SimServer:
+    def __init__(self, address=DEFAULT_ADDRESS, workers=None, preload=(), jar_path=None):
+        ''' address: (host, port) to listen on, keep it on localhost - jobs name files on this machine
+            workers: number of worker processes, each with its own JVM, defaults to the number of CPUs
+            preload: .ork files each worker loads on startup
+            jar_path: OpenRocket .jar the workers run, None for orhelper's default '''
+        self.address = parse_address(address)
+        self.authkey = os.environ.get(AUTHKEY_ENV) or None
+        if self.authkey is None: # never fall back to a well known key, anyone with it can run code here
+            self.authkey = secrets.token_hex(16)
+            print("No " + AUTHKEY_ENV + " set, clients must set " + AUTHKEY_ENV + "=" + self.authkey)
+        self.authkey = self.authkey.encode()
+        self.pool = SimPool(workers, preload=[os.path.abspath(x) for x in preload], jar_path=jar_path)
+        self.listener = None
+        self.stopped = threading.Event()
+
+    def serve_forever(self):
+        ''' Accept clients until a client asks the server to shut down, handling each on its own thread. '''
+        self.listener = Listener(self.address, authkey=self.authkey)
+        print("Serving simulations on " + self.address[0] + ":" + str(self.address[1]) + " with " + str(self.pool.workers) + " workers")
+        try:
+            while not self.stopped.is_set():
+                try:
+                    conn = self.listener.accept()
+                except (OSError, EOFError, AuthenticationError): # listener closed by shutdown, or a client that failed to authenticate
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            self.pool.terminate()
+
+    def handle(self, conn):
+        ''' Serve one client's requests until it disconnects. '''
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if message[0] == 'imap':
+                    if not self.run_jobs(conn, message[1]):
+                        return
+                elif message[0] == 'simulations':
+                    try:
+                        conn.send(('result', self.pool.simulations(message[1])))
+                    except (EOFError, OSError):
+                        return
+                    except Exception as e:
+                        conn.send(('error', e))
+                elif message[0] == 'ping':
+                    conn.send(('pong', self.pool.workers))
+                elif message[0] == 'shutdown':
+                    self.shutdown()
+                    return
+                # a 'cancel' arriving after its imap already finished is ignored
+
+    def run_jobs(self, conn, jobs):
+        ''' Run jobs on the pool, sending each result back in order as it finishes. Only a couple of jobs per worker are
+            queued on the pool at a time, so when the client cancels or disconnects, the pool is free for other clients as
+            soon as the jobs already running finish. Returns False if the client went away. '''
+        jobs = iter(jobs)
+        pending = collections.deque()
+        try:
+            while True:
+                while len(pending) < 2*self.pool.workers:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    pending.append(self.pool.submit(job))
+                if not pending:
+                    break
+                conn.send(('result', pending.popleft().get()))
+                if conn.poll() and conn.recv()[0] == 'cancel':
+                    break
+            conn.send(('done',))
+        except (EOFError, OSError): # client disconnected, e.g. the run was cancelled
+            return False
+        except Exception as e:
+            conn.send(('error', e))
+        return True
+
+    def shutdown(self):
+        self.stopped.set()
+        try: # unblock accept() by connecting to ourselves
+            Client(self.address, authkey=self.authkey).close()
+        except (OSError, EOFError, AuthenticationError):
+            pass
+        self.listener.close()
+
+class SimClient:
+    def __init__(self, address=DEFAULT_ADDRESS):
+        ''' Connects to a running SimServer, authenticating with the key in ORKPLUS_AUTHKEY. Raises ConnectionRefusedError
+            if no server is listening at address, or a ValueError if ORKPLUS_AUTHKEY isn't set. '''
+        self.address = parse_address(address)
+        self.conn = Client(self.address, authkey=get_authkey())
+
+    @property
+    def workers(self):
+        self.conn.send(('ping',))
+        return self.conn.recv()[1]
+
+    def imap(self, jobs):
+        ''' Runs jobs on the server, returning an iterator over their results in the order the jobs were given. '''
+        self.conn.send(('imap', list(jobs)))
+        while True:
+            message = self.conn.recv()
+            if message[0] == 'result':
+                yield message[1]
+            elif message[0] == 'done':
+                return
+            else:
+                raise message[1]
+
+    def simulations(self, ork_file):
+        ''' Returns the simulations of ork_file, a dict of simulation name to motor, without starting a JVM here. '''
+        self.conn.send(('simulations', os.path.abspath(ork_file)))
+        message = self.conn.recv()
+        if message[0] == 'error':
+            raise message[1]
+        return message[1]
+
+    def shutdown(self):
+        ''' Ask the server to stop. '''
+        self.conn.send(('shutdown',))
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def terminate(self):
+        ''' Cancel the jobs still running on the server, e.g. when a run is cancelled part way through, and disconnect. '''
+        try:
+            self.conn.send(('cancel',))
+        except (EOFError, OSError):
+            pass
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex, value, tb):
+        if ex is None:
+            self.close()
+        else:
+            self.terminate()
@@ -0,0 +1,84 @@
+'''
+Sweep:
+
+Deterministic parameter sweeps over launch conditions and simulations (i.e. motor configurations), e.g. wind speed x
+launch rod angle x motor for go/no-go wind limit charts. Every grid point is run as a job on a SimPool, and the results
+are collected into one table with a row of output values per grid point.
+'''
+
+import os
+import csv
+import itertools
+import numpy as np
+from .Sim import Sim
+from .SimPool import SimPool
+from .SimServer import SimClient
+
+class ParameterSweep:
+    def __init__(self, ork_file, grid, sims=(0,), iterations=1, seed=None, sim_labels=None):
+        ''' ork_file: the OpenRocket document
+            grid: dict mapping launch conditions (see Sim.set_parameters) to the list of values to sweep over
+            sims: indices of the simulations to sweep, e.g. one per motor configuration
+            iterations: Monte Carlo iterations per grid point, varying parameters around it. 1 runs each point once, unvaried.
+            seed: seed for the variations when iterations > 1
+            sim_labels: optional dict mapping simulation index to a dict of columns to label its rows with (e.g. name, motor)
+        '''
+        self.ork_file = os.path.abspath(ork_file) # absolute, jobs may run in another working directory (see SimServer)
+        self.grid = dict(grid)
+        self.sims = list(sims)
+        self.iterations = max(1, iterations)
+        self.seed = seed
+        self.sim_labels = sim_labels or {}
+        self.rows = []
+
+    def points(self):
+        ''' Returns every grid point as (simulation index, launch conditions dict). '''
+        keys = list(self.grid.keys())
+        return [(idx, dict(zip(keys, values))) for idx in self.sims for values in itertools.product(*self.grid.values())]
+
+    def jobs(self, points):
+        for p, (idx, params) in enumerate(points):
+            for i in range(self.iterations):
+                seed = None if self.seed is None else str(self.seed) + ':' + str(p) + ':' + str(i)
+                yield {'ork_file':self.ork_file, 'idx':idx, 'vary':self.iterations > 1, 'seed':seed,
+                       'perturbations':Sim.perturbations, 'datatypes':[], 'params':params, 'summary':True}
+
+    def run(self, workers=None, progress=None, server=None, jar_path=None):
+        ''' Run every grid point across a pool of workers, returning the table of results as a list of row dicts.
+            Rows hold the grid point and the mean of each of Sim.outputs, plus its std. dev. when iterations > 1.
+            progress: optional function called as progress(jobs finished, jobs)
+            server: optional address of a SimServer to run the jobs on instead of starting a pool
+            jar_path: OpenRocket .jar for the pool's workers, None for orhelper's default '''
+        points = self.points()
+        num_jobs = len(points)*self.iterations
+        values = []
+        pool = SimClient(server) if server is not None else SimPool(min(workers or os.cpu_count(), num_jobs), jar_path=jar_path)
+        with pool:
+            for j, result in enumerate(pool.imap(self.jobs(points))):
+                values.append(result)
+                if progress is not None:
+                    progress(j+1, num_jobs)
+
+        self.rows = []
+        for p, (idx, params) in enumerate(points):
+            row = {'sim':idx}
+            row.update(self.sim_labels.get(idx, {}))
+            row.update(params)
+            point_values = values[p*self.iterations:(p+1)*self.iterations]
+            for output in Sim.outputs:
+                vals = np.array([v[output.name] for v in point_values], dtype=float)
+                row[output.name] = float(np.nanmean(vals)) if np.any(~np.isnan(vals)) else np.nan
+                if self.iterations > 1:
+                    row[output.name + ' std'] = float(np.nanstd(vals)) if np.any(~np.isnan(vals)) else np.nan
+            self.rows.append(row)
+        return self.rows
+
+    def column(self, name):
+        ''' Returns a column of the results table as an array. '''
+        return np.array([row[name] for row in self.rows])
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(self.rows)
@@ -0,0 +1,95 @@
+'''
+metrics:
+
+Registry of the derived metrics (ExtendedDataTypes) computed from each iteration's timeseries. Each metric declares
+the data types it's computed from, its unit and a vectorized function computing it from those timeseries. Metrics are
+computed the first time something looks them up in an iteration's data, and kept from then on (see SimResults.RunData),
+so metrics nothing uses cost nothing.
+
+Adding a metric is a call to register, e.g. for a custom data type key:
+    register('TYPE_MOMENTUM', 'Momentum', 'kg*m*s^-1', [FlightDataType.TYPE_MASS, FlightDataType.TYPE_VELOCITY_TOTAL],
+             lambda mass, vel: mass*vel)
+'''
+
+import numpy as np
+from .orhelperhelper import DataType, DataTypeMap, ExtendedDataType, ListenerDataType
+
+class Metric:
+    def __init__(self, key, name, unit, inputs, compute):
+        self.key = key
+        self.name = name
+        self.unit = unit
+        self.inputs = list(inputs)
+        self.compute = compute
+
+    def evaluate(self, data):
+        ''' Compute the metric from data, a dict of data types to arrays that computes missing metrics, see RunData. '''
+        with np.errstate(divide='ignore', invalid='ignore'): # NaN outside of the phases a metric applies to
+            return np.asarray(self.compute(*[np.asarray(data[x]) for x in self.inputs]))
+
+registry = {} # data type key -> Metric
+
+def register(key, name, unit, inputs, compute):
+    ''' Register a derived metric, and add it to DataTypeMap so it can be plotted and used by SimOutputs.
+        key: the data type key, an ExtendedDataType or any other hashable not already in DataTypeMap
+        name, unit: description and unit, as in DataTypeMap
+        inputs: the data types it's computed from - FlightDataTypes, ListenerDataTypes or other metrics
+        compute: function taking the inputs' arrays as positional arguments, in order, returning the metric's array '''
+    registry[key] = Metric(key, name, unit, inputs, compute)
+    DataTypeMap[key] = DataType(name, unit)
+    return registry[key]
+
+def is_metric(key):
+    return key in registry
+
+def base_inputs(keys):
+    ''' The data types that aren't metrics needed to compute keys, e.g. the FlightDataTypes to extract for them. '''
+    inputs = set()
+    pending = list(keys)
+    while pending:
+        key = pending.pop()
+        if key in registry:
+            pending.extend(registry[key].inputs)
+        else:
+            inputs.add(key)
+    return inputs
+
+def computable_from(available):
+    ''' The metrics that can be computed from the data types in available alone, e.g. from ORSimListener's results. '''
+    available = set(available)
+    return [key for key in registry if base_inputs([key]) <= available]
+
+''' Stability and flutter metrics, from the inputs recorded by ORSimListener. '''
+SAFETY_FACTOR = 10 # safety factor on shear moduli for orthotropic consideration
+
+register(ExtendedDataType.TYPE_DAMPING_COEFF, 'Damping Coefficient', 'unitless',
+         [ListenerDataType.TYPE_PROPELLANT_MASS_FLOW, ListenerDataType.TYPE_ROCKET_LENGTH, ListenerDataType.TYPE_CG_LOCATION,
+          ListenerDataType.TYPE_AIR_DENSITY, ListenerDataType.TYPE_VELOCITY, ListenerDataType.TYPE_REFERENCE_AREA,
+          ListenerDataType.TYPE_CNA_CG_SQ_SUM],
+         # propulsive (C2R) plus aerodynamic (C2A) damping coefficients
+         lambda prop_mdot, x_ne, cg, dens, vel, area_ref, cna_cg_sq: prop_mdot*(x_ne-cg)**2 + 0.5*dens*vel*area_ref*cna_cg_sq)
+register(ExtendedDataType.TYPE_DAMPING_RATIO, 'Damping Ratio', 'unitless',
+         [ExtendedDataType.TYPE_DAMPING_COEFF, ExtendedDataType.TYPE_CORRECTIVE_COEFF, ListenerDataType.TYPE_LONGITUDINAL_INERTIA],
+         lambda C2, C1, I_long: C2/(2*np.sqrt(C1*I_long)))
+register(ExtendedDataType.TYPE_CORRECTIVE_COEFF, 'Corrective Moment Coefficient', 'unitless',
+         [ListenerDataType.TYPE_AIR_DENSITY, ListenerDataType.TYPE_VELOCITY, ListenerDataType.TYPE_REFERENCE_AREA,
+          ListenerDataType.TYPE_CNA_SUM, ListenerDataType.TYPE_CP_SUM, ListenerDataType.TYPE_CG_LOCATION],
+         lambda dens, vel, area_ref, cna, cp, cg: 0.5*dens*(vel**2)*area_ref*cna*(cp-cg))
+register(ExtendedDataType.TYPE_NATURAL_FREQUENCY, 'Natural Frequency', 'rad*s^-1',
+         [ExtendedDataType.TYPE_CORRECTIVE_COEFF, ListenerDataType.TYPE_LONGITUDINAL_INERTIA],
+         lambda C1, I_long: np.sqrt(C1/I_long))
+register(ExtendedDataType.TYPE_DYNAMIC_PRESSURE, 'Dynamic Pressure', 'Pa',
+         [ListenerDataType.TYPE_AIR_DENSITY, ListenerDataType.TYPE_VELOCITY],
+         lambda dens, vel: 0.5*dens*(vel**2))
+register(ExtendedDataType.TYPE_FLUTTER_VELOCITY, 'Fin Flutter Velocity (Unity Shear Modulus)', 'm*s^-1',
+         [ListenerDataType.TYPE_SPEED_OF_SOUND, ListenerDataType.TYPE_FLUTTER_COEFF, ListenerDataType.TYPE_AIR_PRESSURE],
+         lambda soundspeed, vf_coeff, pres: soundspeed*vf_coeff/np.sqrt(pres))
+register(ExtendedDataType.TYPE_CHAR_OSCILLATION_DISTANCE, 'Charateristic Oscillation Length', 'm',
+         [ExtendedDataType.TYPE_NATURAL_FREQUENCY, ListenerDataType.TYPE_VELOCITY],
+         lambda NF, vel: NF/vel)
+register(ExtendedDataType.TYPE_FLUTTER_VELOCITY_CF, 'Carbon Fiber Fin Flutter Velocity', 'm*s^-1',
+         [ExtendedDataType.TYPE_FLUTTER_VELOCITY],
+         lambda VF: VF*np.sqrt(1E10/SAFETY_FACTOR)) # shear modulus of carbon fiber, ~10GPa
+register(ExtendedDataType.TYPE_FLUTTER_VELOCITY_FG, 'Fiberglass Fin Flutter Velocity', 'm*s^-1',
+         [ExtendedDataType.TYPE_FLUTTER_VELOCITY],
+         lambda VF: VF*np.sqrt(3E10/SAFETY_FACTOR)) # shear modulus of fiber glass, ~30GPa
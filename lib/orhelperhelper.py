@@ -1,10 +1,12 @@
 from logging import root
+import os
 import orhelper
 from orhelper import FlightDataType, FlightEvent
 from orhelper import JIterator
 from enum import Enum
 from typing import Union, List, Iterable, Dict
 import numpy as np
+import jpype
 
 ''' Extend FlightDataType to include our added data types. '''
 flightdatalen = max([x.value for x in FlightDataType])
@@ -19,7 +21,25 @@ class ExtendedDataType(Enum):
     TYPE_FLUTTER_VELOCITY_CF = flightdatalen + 8
     TYPE_FLUTTER_VELOCITY_FG = flightdatalen + 9
 
-''' Create dict that provides mapping from FlightDataType/ExtendedDataType to string desc and unit. '''
+''' Per-step values recorded by ORSimListener, the inputs the ExtendedDataTypes are computed from (see metrics). '''
+extendeddatalen = max([x.value for x in ExtendedDataType])
+class ListenerDataType(Enum):
+    TYPE_PROPELLANT_MASS_FLOW = extendeddatalen + 1
+    TYPE_AIR_PRESSURE = extendeddatalen + 2
+    TYPE_SPEED_OF_SOUND = extendeddatalen + 3
+    TYPE_AIR_DENSITY = extendeddatalen + 4
+    TYPE_REFERENCE_AREA = extendeddatalen + 5
+    TYPE_VELOCITY = extendeddatalen + 6
+    TYPE_LONGITUDINAL_INERTIA = extendeddatalen + 7
+    TYPE_CG_LOCATION = extendeddatalen + 8
+    TYPE_CP_SUM = extendeddatalen + 9 # sum of the aerodynamic components' CPs
+    TYPE_CNA_SUM = extendeddatalen + 10 # sum of the aerodynamic components' CNas
+    TYPE_CNA_CG_SQ_SUM = extendeddatalen + 11 # sum of (CNa - CG)**2 over the aerodynamic components
+    TYPE_ROCKET_LENGTH = extendeddatalen + 12 # nose to nozzle exit
+    TYPE_FLUTTER_COEFF = extendeddatalen + 13 # see calculate_fin_flutter_coeff
+
+''' Create dict that provides mapping from FlightDataType/ExtendedDataType to string desc and unit.
+    The ExtendedDataTypes are added as their metrics are registered, see metrics. '''
 class DataType:
     def __init__(self, name, unit):
         self.name = name
@@ -77,15 +97,6 @@ DataTypeMap = {
     FlightDataType.TYPE_SPEED_OF_SOUND : DataType('Speed of Sound','m*s^-1'),
     FlightDataType.TYPE_TIME_STEP : DataType('Time Step','s'),
     FlightDataType.TYPE_COMPUTATION_TIME : DataType('Computation Time','s'),
-    ExtendedDataType.TYPE_DAMPING_COEFF : DataType('Damping Coefficient','unitless'),
-    ExtendedDataType.TYPE_DAMPING_RATIO : DataType('Damping Ratio','unitless'),
-    ExtendedDataType.TYPE_CORRECTIVE_COEFF : DataType('Corrective Moment Coefficient','unitless'),
-    ExtendedDataType.TYPE_NATURAL_FREQUENCY : DataType('Natural Frequency','rad*s^-1'),
-    ExtendedDataType.TYPE_DYNAMIC_PRESSURE : DataType('Dynamic Pressure','Pa'),
-    ExtendedDataType.TYPE_FLUTTER_VELOCITY : DataType('Fin Flutter Velocity (Unity Shear Modulus)','m*s^-1'),
-    ExtendedDataType.TYPE_CHAR_OSCILLATION_DISTANCE : DataType('Charateristic Oscillation Length','m'),
-    ExtendedDataType.TYPE_FLUTTER_VELOCITY_CF : DataType('Carbon Fiber Fin Flutter Velocity','m*s^-1'),
-    ExtendedDataType.TYPE_FLUTTER_VELOCITY_FG : DataType('Fiberglass Fin Flutter Velocity','m*s^-1'),
 }
 
 EventTypeMap = {
@@ -106,13 +117,75 @@ EventTypeMap = {
 }
 
 ''' orhelper add-on functions. '''
+_doc_cache = {} # loaded documents, maps absolute path of the .ork file to (modification time, document)
+
+def load_doc(orh, ork_file):
+    ''' Load an OpenRocket document, reusing the copy already loaded in this process if the file hasn't changed since.
+        The returned document is shared - use get_isolated_simulation to get a simulation that is safe to modify. '''
+    path = os.path.abspath(ork_file)
+    mtime = os.path.getmtime(path)
+    hit = _doc_cache.get(path)
+    if hit is None or hit[0] != mtime:
+        hit = (mtime, orh.load_doc(path))
+        _doc_cache[path] = hit
+    return hit[1]
+
+def get_isolated_simulation(doc, idx):
+    ''' Returns a copy of simulation idx of doc, backed by its own copy of the rocket, so changes to it (mass overrides,
+        launch conditions) never reach the document. '''
+    sim = doc.getSimulation(idx)
+    return sim.duplicateSimulation(doc.getRocket().copyWithOriginalID())
+
+COMPONENT_PKG = 'net.sf.openrocket.rocketcomponent.'
+_component_indices = {} # rocket -> (tree modification ID, ComponentIndex), see get_component_index
+MAX_COMPONENT_INDICES = 16 # rockets indexed at once, the oldest are dropped first
+
+class ComponentIndex:
+    ''' The components of a rocket from a single walk of its tree, grouped by type. Use get_component_index to get
+        the cached index of a rocket rather than making a new one. '''
+    def __init__(self, rocket):
+        self.components = list(JIterator(rocket))
+        self.by_type = {} # simple Java class name, e.g. 'TrapezoidalFinSet' -> components of that class
+        for component in self.components:
+            self.by_type.setdefault(str(component.getClass().getSimpleName()), []).append(component)
+        FinSet = jpype.JClass(COMPONENT_PKG + 'FinSet')
+        TrapezoidalFinSet = jpype.JClass(COMPONENT_PKG + 'TrapezoidalFinSet')
+        MotorMount = jpype.JClass(COMPONENT_PKG + 'MotorMount')
+        self.massive = [x for x in self.components if bool(x.isMassive())]
+        self.fin_sets = [x for x in self.components if isinstance(x, FinSet)]
+        self.trapezoidal_fin_sets = [x for x in self.fin_sets if isinstance(x, TrapezoidalFinSet)]
+        self.motor_mounts = [x for x in self.components if isinstance(x, MotorMount)]
+
+    def of_type(self, name):
+        ''' Components whose Java class is named name, e.g. 'BodyTube'. '''
+        return self.by_type.get(name, [])
+
+    def get_motor(self, motorconfig_id):
+        ''' The first motor mounted for a motor configuration, or None if it has no motor. '''
+        for mount in self.motor_mounts:
+            motor = mount.getMotor(motorconfig_id)
+            if motor is not None:
+                return motor
+        return None
+
+def get_component_index(rocket):
+    ''' Returns the ComponentIndex of rocket, reusing the one already built unless components have been added, removed
+        or moved since (changes to components' properties, like mass overrides, don't need a new index). '''
+    tree_mod_id = int(rocket.getTreeModID())
+    hit = _component_indices.get(rocket)
+    if hit is None or hit[0] != tree_mod_id:
+        if hit is None and len(_component_indices) >= MAX_COMPONENT_INDICES:
+            del _component_indices[next(iter(_component_indices))]
+        hit = (tree_mod_id, ComponentIndex(rocket))
+        _component_indices[rocket] = hit
+    return hit[1]
+
 def get_all_components(rocket,debug=False):
     ''' Get all components objects and return them as a list. '''
-    ret = []
-    for component in JIterator(rocket):
-         ret.append(component)
-         if debug:
-             print(component.getName())
+    ret = list(get_component_index(rocket).components)
+    if debug:
+        for component in ret:
+            print(component.getName())
     return ret
 
 def calculate_fin_flutter_coeff(rocket):
@@ -123,16 +196,10 @@ def calculate_fin_flutter_coeff(rocket):
                    G = shear modulus of fin material (assumed isotropic)
                    P = static pressure at current altitude
      '''
-    fins = None
-    for component in JIterator(rocket):
-        try:
-            component.getRootChord() # check to see if component is a TrapezoidalFinSet
-            fins = component
-            break
-        except:
-            pass
-    if fins is None:
+    fin_sets = get_component_index(rocket).trapezoidal_fin_sets
+    if len(fin_sets) == 0:
         raise AttributeError("Rocket does not have a trapezoidal fin set.")
+    fins = fin_sets[0]
     rootchord = float(fins.getRootChord())
     tipchord = float(fins.getTipChord())
     thickness = float(fins.getThickness())
@@ -151,21 +218,66 @@ def get_simulations(doc):
         this_sim_name = str(sim.getName()) 
         sim_opts = sim.getOptions()
         motorconfig_id = sim_opts.getMotorConfigurationID()
-        config = sim.getConfiguration() # create new config
-        found_motor = False
-        for comp in JIterator(sim.getRocket()):
-            try:
-                motor_name = comp.getMotor(motorconfig_id).getDesignation()
-                this_motor = str(motor_name)
-                found_motor = True
-                break
-            except Exception as e:
-                pass
-        if not(found_motor):
-            this_motor = 'No Motor' 
+        motor = get_component_index(sim.getRocket()).get_motor(motorconfig_id)
+        this_motor = str(motor.getDesignation()) if motor is not None else 'No Motor'
         ret[this_sim_name] = this_motor
     return ret
 
+def run_simulation(orh, sim, listeners=None, seed=None):
+    ''' Run a simulation like orh.run_simulation, but with OpenRocket's random seed (used for wind turbulence) set to seed
+        instead of randomized, so that runs can be repeated exactly. If seed is None, the seed is randomized as usual. '''
+    if seed is None:
+        return orh.run_simulation(sim, listeners=listeners)
+    listener_pkg = orh.openrocket.simulation.listeners
+    listener_array = [jpype.JProxy((listener_pkg.SimulationListener,
+                                    listener_pkg.SimulationEventListener,
+                                    listener_pkg.SimulationComputationListener,
+                                    jpype.java.lang.Cloneable), inst=c) for c in (listeners or [])]
+    if len(listener_array) == 0:
+        listener_array = jpype.JArray(listener_pkg.AbstractSimulationListener, 1)(0)
+    sim.getOptions().setRandomSeed(int(seed))
+    sim.simulate(listener_array)
+
+_converters = None # (List -> Stream, Double -> double) Java functional interfaces, made once the JVM is running
+
+def _get_converters():
+    ''' Java Function and ToDoubleFunction instances made from method handles, so streams can unbox whole lists
+        inside the JVM without calling back into Python for each element. '''
+    global _converters
+    if _converters is None:
+        MethodHandles = jpype.JClass('java.lang.invoke.MethodHandles')
+        MethodHandleProxies = jpype.JClass('java.lang.invoke.MethodHandleProxies')
+        MethodType = jpype.JClass('java.lang.invoke.MethodType')
+        Double = jpype.JClass('java.lang.Double')
+        Stream = jpype.JClass('java.util.stream.Stream')
+        Collection = jpype.JClass('java.util.Collection')
+        lookup = MethodHandles.publicLookup()
+        to_stream = lookup.findVirtual(Collection.class_, 'stream', MethodType.methodType(Stream.class_))
+        to_double = lookup.findVirtual(Double.class_, 'doubleValue', MethodType.methodType(Double.TYPE))
+        _converters = (MethodHandleProxies.asInterfaceInstance(jpype.JClass('java.util.function.Function').class_, to_stream),
+                       MethodHandleProxies.asInterfaceInstance(jpype.JClass('java.util.function.ToDoubleFunction').class_, to_double))
+    return _converters
+
+def lists_to_numpy(lists, length):
+    ''' Convert Java List<Double>s to numpy arrays, unboxing every list into one Java double[] inside the JVM and moving
+        that into numpy in a single transfer, instead of converting element by element across JPype.
+        Lists that are None (data types a branch doesn't have) become length NaNs. '''
+    present = [values for values in lists if values is not None]
+    sizes = [int(values.size()) for values in present]
+    if len(present) > 0:
+        to_stream, to_double = _get_converters()
+        java_lists = jpype.JClass('java.util.Arrays').asList(jpype.JArray(jpype.JClass('java.util.List'))(present))
+        flat = np.array(java_lists.stream().flatMap(to_stream).mapToDouble(to_double).toArray(), dtype=np.float64)
+    else:
+        flat = np.empty(0)
+    columns = iter(np.split(flat, np.cumsum(sizes)[:-1]))
+    return [next(columns) if values is not None else np.full(length, np.nan) for values in lists]
+
+def get_branch_data(orh, branch, datatypes):
+    ''' Get the timeseries of each of datatypes from a FlightDataBranch, returned as a dict of numpy arrays. '''
+    lists = [branch.get(orh.translate_flight_data_type(datatype)) for datatype in datatypes]
+    return dict(zip(datatypes, lists_to_numpy(lists, int(branch.getLength()))))
+
 def get_status_flight_data(status, variables : Iterable[Union[FlightDataType, str]]):
     ''' Get most recent flight data values from a simulation status. '''
     def translate_flight_data_type(flight_data_type:Union[FlightDataType, str]):
@@ -178,7 +290,6 @@ def get_status_flight_data(status, variables : Iterable[Union[FlightDataType, st
         return getattr(FlightDataType, name)
 
     branch = status.getFlightData()
-    output = dict()
-    for v in variables:
-        output[v] = np.array(branch.get(translate_flight_data_type(v)))
-    return output
+    variables = list(variables)
+    lists = [branch.get(translate_flight_data_type(v)) for v in variables]
+    return dict(zip(variables, lists_to_numpy(lists, int(branch.getLength()))))
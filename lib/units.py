@@ -6,6 +6,7 @@ functions. The functions use numpy array-friendly operations to allow users to p
 of a single value, should they wish.
 '''
 
+import itertools
 import numpy as np
 
 ''' The unit lib stores conversion functions that take a value, x, from a given unit to the base unit. Metric modifiers on base units are 
@@ -59,9 +60,34 @@ unit_preferred = {
     "rad" : "deg",
 }
 
+''' The unit index maps each unit's case-folded name to its base unit and its name as written in the unit_lib, so looking up
+    a unit is a dict lookup rather than a search of the unit_lib. Built once, when the module loads.
+    Ex: unit_index['ft'] is ('m', 'ft')
+'''
+unit_index = {}
+for base_unit in unit_lib:
+    for unit in unit_lib[base_unit]:
+        unit_index.setdefault(unit.casefold(), (base_unit, unit))
+
+''' The power alias maps a power of a base unit that the unit_lib lists under another base unit to that base unit and the
+    multiplier into it, so a length cubed is a volume in L whether it's written m^3, cm^3 or mi^3. Built once, when the module loads.
+    Ex: power_alias[('m', 3.0)] is ('L', 1E3)
+'''
+power_alias = {}
+for base_unit in unit_lib:
+    for unit in unit_lib[base_unit]:
+        name, _, powerstr = unit.partition('^')
+        if powerstr and name in unit_lib:
+            power_alias.setdefault((name, float(powerstr)), (base_unit, unit_lib[base_unit][unit]))
+
 class Units():
     def __init__(self):
-        pass
+        self.plans = {} # (from_unit, to_unit, power) -> ConversionPlan, or None if the units can't be converted
+        self.dimensions = {} # unit -> dimension, see get_dimension
+        self.compatible = {} # (unit, power) -> list of compatible units, see get_compatible_units
+        for unit in unit_index.values(): # index every unit in the lib up front
+            self.get_dimension(unit[1])
+            self.get_compatible_units(unit[1])
 
     def get_available_units(self):
         ''' Returns a list of all available units defined in the units lib '''
@@ -99,53 +125,88 @@ class Units():
         ''' Returns a list of units compatible with the given unit. 
             The returned list will contain the given unit, unless no other compatible units are found.
         '''  
+        try:
+            return list(self.compatible[(unit, power)])
+        except KeyError:
+            pass
         # Check for composite unit
         split_units = [x.strip(' ()') for x in unit.split('*')] 
         if len(split_units) > 1:
-            comp_units = []
-            for x in self.get_compatible_units(split_units[0]):
-                for y in self.get_compatible_units(split_units[1]):
-                    comp_units = comp_units + [x+'*'+y]
-            return comp_units
+            comp_units = ['*'.join(x) for x in itertools.product(*[self.get_compatible_units(x) for x in split_units])]
+        else:
+            comp_units = self.find_compatible_units(unit, power)
+        self.compatible[(unit, power)] = comp_units
+        return list(comp_units)
 
-        my_base_unit = None 
-        # Search for the unit in the unit lib
-        for base_unit in unit_lib:
-            for each_unit in unit_lib[base_unit]:
-                if unit.casefold() == each_unit.casefold() :
-                    my_base_unit = base_unit
-                    break
-        
-        if my_base_unit == None: # if didn't find it in the lib, try removing a power
-            powercheck = unit.split('^') # check to see if unit is taken to a power
-            unit = powercheck[0]
-            if len(powercheck) > 1:
-                try:
-                    return self.get_compatible_units(unit, int(powercheck[1])) # pass w power arg
-                except:
-                    return [] # if power is invalid, return empty string
+    def find_compatible_units(self, unit, power = 1):
+        ''' Returns the list of units compatible with a single (not composite) unit, see get_compatible_units. '''
+        found = self.resolve_unit(unit, power)
+        if found is None:
+            return [] # If you still don't find a base unit, return empty list
+        base_unit, power = found[:2]
+        if power == 1:
+            return list(unit_lib[base_unit].keys()) # return list of keys for that base unit
+        else:
+            return list([key + '^' + '{:g}'.format(power) for key in unit_lib[base_unit].keys() ]) # return list of key with power modifier
 
-        
-        if my_base_unit is None: # check for metrix prefix
-            for prefix in metric_mult:
-                if unit[:len(prefix)].casefold() == prefix.casefold():
-                    return self.get_compatible_units(unit[len(prefix):], power) 
+    def resolve_unit(self, unit, power = 1.0):
+        ''' Returns how a single (not composite) unit, raised to power, relates to its base unit, as (base unit, power,
+            (prefix, unit, alias) multipliers, offset): value * prefix * unit * alias + offset is the value in the base unit
+            to the power. The metric prefix is raised to the unit's power along with the unit, and powers the unit_lib lists
+            under another base unit are taken to that base unit (see power_alias), so 'cm^3' is in L just as 'm^3' is.
+            Returns None if unit isn't a valid unit.
+            Ex: resolve_unit('km^2') is ('m', 2.0, (1E6, 1.0, 1), None)
+        '''
+        prefix = 1
+        found = unit_index.get(unit.casefold()) # units in the lib with powers, e.g. m^3 (base: Liter)
+        if found is None:
+            name, _, powerstr = unit.partition('^')
+            try:
+                power = power * float(powerstr) if powerstr else power
+            except ValueError:
+                return None
+            found = unit_index.get(name.casefold())
+            if found is None: # check for metric prefix
+                for mult in metric_mult:
+                    if name[:len(mult)].casefold() == mult.casefold():
+                        found = unit_index.get(name[len(mult):].casefold())
+                        if found is not None:
+                            prefix = np.power(metric_mult[mult], float(power))
+                            break
+            if found is None:
+                return None
+        base_unit, unit = found
+        mults = (prefix, np.power(unit_lib[base_unit][unit], float(power)), 1)
+        offset = unit_offset.get(base_unit, {}).get(unit)
+        if (base_unit, power) in power_alias:
+            base_unit, alias = power_alias[(base_unit, power)]
+            mults = mults[:2] + (alias,)
+            power = 1.0
+        return base_unit, float(power), mults, offset
 
-        if my_base_unit is None: # If you still don't find a base unit, return empty list
-            return []
-        else:
-            if power == 1:
-                return list(unit_lib[my_base_unit].keys()) # return list of keys for that base unit
-            else:
-                return list([key + '^' + str(power) for key in unit_lib[my_base_unit].keys() ]) # return list of key with power modifier
+    def get_dimension(self, unit):
+        ''' Returns the dimension of unit: a tuple of (base unit, power) for each unit in a composite unit, in order, e.g.
+            'ft*s^-2' is (('m', 1.0), ('s', -2.0)). Units with the same dimension can be converted to each other.
+            Returns None if unit isn't a valid unit.
+        '''
+        try:
+            return self.dimensions[unit]
+        except KeyError:
+            pass
+        dimension = []
+        for split_unit in [x.strip(' ()') for x in unit.split('*')]:
+            found = self.resolve_unit(split_unit)
+            if found is None:
+                dimension = None
+                break
+            dimension.append(found[:2])
+        self.dimensions[unit] = None if dimension is None else tuple(dimension)
+        return self.dimensions[unit]
 
     def validate_units(self, from_unit, to_unit): 
         ''' Returns true if from_unit can be converted to to_unit by this module. Otherwise returns false. '''
-        try:
-            self.convert(1.0, to_unit, from_unit)
-            return True
-        except KeyError:
-            return False
+        dimension = self.get_dimension(from_unit)
+        return dimension is not None and dimension == self.get_dimension(to_unit)
 
     def convert(self, value, from_unit, to_unit, power = 1.0):
         ''' Returns the conversion of a value in one unit to a compatible unit.
@@ -161,100 +222,146 @@ class Units():
             INCORRECT
                 to_unit = 'kg * m^-2 * s' and to_unit = 's * lb * in^-2 ' are NOT compatible
         '''
+        return self.get_plan(from_unit, to_unit, power)(value)
+
+    def get_plan(self, from_unit, to_unit, power = 1.0):
+        ''' Returns the ConversionPlan from from_unit to to_unit, compiling it the first time a pair is asked for.
+            Raises a KeyError if the units passed are incompatible or invalid (failures are remembered too). '''
+        key = (from_unit, to_unit, power)
+        try:
+            plan = self.plans[key]
+        except KeyError:
+            try:
+                plan = ConversionPlan(self.compile(from_unit, to_unit, power))
+            except KeyError:
+                plan = None
+            self.plans[key] = plan
+        if plan is None:
+            raise KeyError((from_unit, to_unit))
+        return plan
+
+    def compile(self, from_unit, to_unit, power = 1.0):
+        ''' Returns the list of (numpy operation, operand) steps that convert a value from from_unit to to_unit,
+            see convert. Raises a KeyError if the units passed are incompatible or invalid. '''
         # Check for composite unit
         split_fromunits = [x.strip(' ()') for x in from_unit.split('*')] 
         split_tounits = [x.strip(' ()') for x in to_unit.split('*')]
         if len(split_fromunits) != len(split_tounits):
             raise KeyError # if have different number of composite units
         elif len(split_fromunits) > 1:
-            new_val = value
+            steps = []
             for i in range(0,len(split_fromunits)):
-                new_val = self.convert(new_val,split_fromunits[i], split_tounits[i])
-            return new_val
+                steps += self.compile(split_fromunits[i], split_tounits[i])
+            return steps
 
 
-        my_base_unit = None
-        # Search for the from_unit in the unit lib
-        for base_unit in unit_lib:
-            for unit in unit_lib[base_unit]:
-                if unit.casefold() == from_unit.casefold() :
-                    my_base_unit = base_unit
-                    from_unit = unit
-                    break
-            if my_base_unit is not None:
-                break
-        
-        # if didn't find it, check to see if the units are to powers
-        if my_base_unit is None:
-            powercheck_from = from_unit.split('^') # check to see if unit is taken to a power
-            from_unit = powercheck_from[0]
-            powercheck_to = to_unit.split('^')
-            to_unit = powercheck_to[0]
+        from_found = self.resolve_unit(from_unit, power)
+        to_found = self.resolve_unit(to_unit, power)
+        if from_found is None or to_found is None or from_found[:2] != to_found[:2]:
+            raise KeyError # invalid units, or units of different dimensions
+        _, _, from_mults, from_offset = from_found
+        _, _, to_mults, to_offset = to_found
+        # Convert to base unit, checking to see if an offset exists
+        steps = [(np.multiply, mult) for mult in from_mults] # value (from_unit) * # (base_unit/from_unit) = new value (base_unit)
+        if from_offset is not None:
+            steps.append((np.add, from_offset))
+        # Convert to to_unit, checking to see if an offset exists
+        if to_offset is not None:
+            steps.append((np.subtract, to_offset))
+        steps.append((np.divide, to_mults[2]))
+        steps.append((np.divide, to_mults[1]))
+        steps.append((np.multiply, 1 / to_mults[0])) # apply the to_unit's metric multiplier
+        return steps
 
-            if len(powercheck_from) == len(powercheck_to) and len(powercheck_from) > 1 :
-                try:
-                    if float(powercheck_from[1]) != float(powercheck_to[1]):
-                        raise KeyError # if powers arent equal, return Key Error
-                    else:
-                        return self.convert(value, from_unit, to_unit, float(powercheck_from[1])) # collect the power of the unit
-                except:
-                    raise KeyError
-            elif len(powercheck_from) != len(powercheck_to):
-                from_unit = '^'.join(powercheck_from) # if they arent both to a power, return the values to their initial state, and check them raw against the unit_lib (checking for L and m^3. for example)
-                to_unit = '^'.join(powercheck_to)
+class ConversionPlan():
+    ''' A compiled conversion between two units: the numpy operations Units.convert applies to a value, worked out once.
+        Multiplying or dividing by one is exact, so those steps are dropped, leaving a single operation for most unit
+        pairs. The remaining steps run in the same order with the same operands, so results are identical to running
+        every step (folding the steps into one scale and offset would round differently). '''
+    def __init__(self, steps):
+        self.steps = []
+        promote = False # a dropped step had a numpy operand, which would have promoted the value's type at that point
+        for op, x in steps:
+            if op in (np.multiply, np.divide) and x == 1:
+                promote = promote or isinstance(x, np.generic)
+                continue
+            if promote and not isinstance(x, np.generic):
+                x = np.float64(x)
+            promote = False
+            self.steps.append((op, x))
+        if not self.steps:
+            self.steps = [(np.multiply, np.float64(1.0))] # still return a new float array/scalar, as the full conversion does
 
-        # If didn't find it, from_unit is a metric multiplier of the base unit. 
-        # If so, adjust the value to get it in its base unit equivalent (e.g. take the km value to m)
-        if my_base_unit is None:
-            for prefix in metric_mult:
-                if from_unit[:len(prefix)].casefold() == prefix.casefold():
-                    value = np.multiply(value, np.power( metric_mult[prefix] , power) )
-                    return self.convert(value, from_unit[len(prefix):]+'^'+str(power), to_unit+'^'+str(power)) # having converted to a base unit and multiplied valued, recurse
-        # Do the same as above for the to_unit, defining a multiplier thats applied on the value at end if to_unit is 
-            # a metric multiplier of a base unit
-        mult = 1 # by default, multiplier is 1
-        flag = False
-        for unit in unit_lib[my_base_unit]:
-            if unit.casefold() == to_unit.casefold():
-                to_unit = unit
-                flag = True
-        if flag is False: # If didn't find it, must be a metric multiplier of a base unit
-                for prefix in metric_mult:
-                    if to_unit[:len(prefix)].casefold() == prefix.casefold():
-                        mult = 1 / np.power( metric_mult[prefix] , power)
-                        to_unit = to_unit[len(prefix):]
-                        for unit in unit_lib[my_base_unit]: # if found the metric multiplier, find the key that is the case-insensitive match
-                            if unit.casefold() == to_unit.casefold():
-                                to_unit = unit
-                                break
-                        break
-        # Convert to base unit, checking to see if an offset exists 
-        value = np.multiply(value, np.power(unit_lib[my_base_unit][from_unit], float(power)) ) # value (from_unit) * # (base_unit/from_unit) = new value (base_unit)
-        try:
-            value = np.add(value, unit_offset[my_base_unit][from_unit])
-        except KeyError:
-            pass # KeyError indicates no offset exists for this unit pair
-        # Convert to to_unit, checking to see if an offset exists
+    def __call__(self, value, out = None):
+        ''' Returns value converted. If out is given, the conversion is written into out (a numpy array of value's shape)
+            instead of allocating a new array, and out is returned. '''
+        for op, x in self.steps:
+            value = op(value, x, out=out)
+        return value
+
+class UnitArray():
+    ''' An array of values in a unit, stored once, that hands out the values converted to other units. Each unit's
+        conversion is computed the first time it's asked for and kept (read-only), so switching between units converts
+        the series once per unit rather than on every use.
+        Ex: altitude = UnitArray(data[FlightDataType.TYPE_ALTITUDE], 'm'); altitude.to('ft')
+    '''
+    def __init__(self, values, unit):
+        self.values = np.asarray(values)
+        self.unit = unit
+        self.converted = {} # unit -> values in that unit
+
+    def to(self, unit, out = None):
+        ''' Returns the values in unit. If out is given, the values are converted into out (a numpy array of the same
+            shape) and it is returned, leaving the cached conversions alone.
+            Raises a KeyError if unit can't be converted to from the array's unit. '''
+        if out is not None:
+            return units.get_plan(self.unit, unit)(self.values, out=out)
         try:
-            value = np.subtract(value, unit_offset[my_base_unit][to_unit])
+            return self.converted[unit]
         except KeyError:
-            pass # KeyError indicates no offset exists for this unit pair
-        value = np.divide(value, np.power(unit_lib[my_base_unit][to_unit], float(power)))
-        
-        return np.multiply(value, mult) # apply the multiplier and return
+            pass
+        if unit == self.unit:
+            values = self.values
+        else:
+            values = units.convert(self.values, self.unit, unit)
+            if isinstance(values, np.ndarray):
+                values.flags.writeable = False # shared by everything that asks for this unit
+        self.converted[unit] = values
+        return values
 
 
 units = Units()
 
 
 ### FUNCTIONALITY TESTING ###
-# print( 0 == units.convert(-273.15, 'C', 'K'))
-# print( 2.54 == units.convert(1.0, 'in', 'cm'))
-# print(1000/0.0254 == units.convert(1.0, 'km', 'in'))
-# print(2.54e-5 == units.convert(1.0, 'in', 'km'))
-# print(abs(1/2.21 - units.convert(1.0,'lb','kg')) <= 1E-2)
-# print(abs(0.00155 - units.convert(1.0,'mm^2','in^2')) <=1E-3)
-# print(units.validate_units('L', 'ft^3'))
-# print(units.convert(1.0,'L','ft^3'))
-# print( [[1.0], [2.0], [3.0]] ==  np.divide(units.convert([[1],[2],[3]], 'km', 'in'), 1000/0.0254 ) )
-# print(units.get_compatible_units('m*s^-2'))
+# Run with python lib/units.py, which fails on the first check that doesn't hold
+if __name__ == '__main__':
+    assert 0 == units.convert(-273.15, 'C', 'K')
+    assert 2.54 == units.convert(1.0, 'in', 'cm')
+    assert 1000/0.0254 == units.convert(1.0, 'km', 'in')
+    assert 2.54e-5 == units.convert(1.0, 'in', 'km')
+    assert abs(1/2.21 - units.convert(1.0,'lb','kg')) <= 1E-2
+    assert abs(0.00155 - units.convert(1.0,'mm^2','in^2')) <=1E-3
+    assert units.validate_units('L', 'ft^3')
+    assert abs(0.0353147 - units.convert(1.0,'L','ft^3')) <= 1E-6
+    assert np.array_equal([[1.0], [2.0], [3.0]], np.divide(units.convert([[1],[2],[3]], 'km', 'in'), 1000/0.0254 ))
+    assert 'ft*s^-2' in units.get_compatible_units('m*s^-2')
+    # prefixes are raised to the unit's power, and a length cubed is a volume
+    assert abs(1E-3 - units.convert(1.0,'cm^3','L')) <= 1E-12
+    assert abs(1E6 - units.convert(1.0,'kL','cm^3')) <= 1E-6
+    assert abs(1.0 - units.convert(1.0,'mL','cm^3')) <= 1E-12
+    assert abs(1.0 - units.convert(1.0,'kL','m^3')) <= 1E-12
+    assert abs(1E9 - units.convert(1.0,'km^3','m^3')) <= 1E-3
+    assert abs(1E-3 - units.convert(1.0,'mm^3','cm^3')) <= 1E-15
+    assert units.validate_units('cm^3', 'L') and units.get_dimension('cm^3') == units.get_dimension('m^3')
+    # min and hr are times, never milli-inches or hecto-Rankine
+    assert 60 == units.convert(1.0,'min','s') and 3600 == units.convert(1.0,'hr','s')
+    assert not units.validate_units('m', 'min') and not units.validate_units('K', 'hr')
+    for from_unit, to_unit in (('m', 'min'), ('K', 'hr')):
+        try:
+            units.convert(1.0, from_unit, to_unit)
+        except KeyError:
+            pass
+        else:
+            raise AssertionError((from_unit, to_unit))
+    print('units: all checks passed')